@@ -0,0 +1,354 @@
+"""mNc 端到端基准测试:生成可复现的合成项目,分阶段计时并记录峰值内存,与基线 JSON 比较。
+
+用法:
+    python bench_mNc.py                              # 运行全部场景
+    python bench_mNc.py --scenario tiny_files --scale 0.2
+    python bench_mNc.py --save-baseline base.json    # 保存为基线
+    python bench_mNc.py --baseline base.json         # 与基线比较,出现回退时退出码为 1
+"""
+import sys
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+from typing import Callable, Dict, List, Optional
+
+import mNc
+
+# --- 配置 ---
+
+# 生成器版本:修改生成逻辑后递增,已生成的目录会被重新生成
+GENERATOR_VERSION = 1
+# 默认工作目录。注意不能位于 mNc 的排除路径(如 tmp、.cache)之下,否则整个项目都会被跳过
+DEFAULT_WORKDIR = os.path.join(os.path.expanduser('~'), 'mNc-bench')
+# 判定为回退的相对阈值,以及为避免噪声而忽略的绝对差值下限
+DEFAULT_TOLERANCE = 0.10
+MIN_SECONDS_DELTA = 0.02
+MIN_RSS_DELTA_BYTES = 8 * 1024 * 1024
+
+# --- 合成内容 ---
+
+_WORDS = ['data', 'value', 'index', 'buffer', 'config', 'result', 'handler', 'item', 'node', 'cache',
+          'stream', 'parser', 'token', 'record', 'state', 'event', 'client', 'request', 'render', 'query']
+_CJK_COMMENTS = ['处理输入数据', '返回计算结果', '初始化配置', '检查边界条件', '更新缓存状态']
+
+def _name(rng: random.Random, parts: int = 2) -> str:
+    return '_'.join(rng.choice(_WORDS) for _ in range(parts))
+
+def python_source(rng: random.Random, functions: int) -> str:
+    lines = ['"""Synthetic module."""', 'import os', 'import sys', '']
+    for _ in range(functions):
+        name = _name(rng)
+        lines += [f'def {name}({_name(rng, 1)}, {_name(rng, 1)}=None):',
+                  f'    """{rng.choice(_CJK_COMMENTS)}"""',
+                  f'    {_name(rng, 1)} = [{", ".join(str(rng.randint(0, 999)) for _ in range(8))}]',
+                  f'    if {_name(rng, 1)} is None:',
+                  f'        return os.path.join("{_name(rng, 1)}", "{_name(rng, 1)}")',
+                  f'    return sum({_name(rng, 1)} for _ in range({rng.randint(1, 50)}))', '']
+    return '\n'.join(lines)
+
+def js_source(rng: random.Random, functions: int) -> str:
+    lines = ["'use strict';", '']
+    for _ in range(functions):
+        name = _name(rng).replace('_', '')
+        lines += [f'export function {name}({_name(rng, 1)}, {_name(rng, 1)}) {{',
+                  f'  // {rng.choice(_CJK_COMMENTS)}',
+                  f'  const {_name(rng, 1)} = [{", ".join(str(rng.randint(0, 999)) for _ in range(8))}];',
+                  f'  return {_name(rng, 1)}.map((x) => x * {rng.randint(2, 9)});',
+                  '}', '']
+    return '\n'.join(lines)
+
+def java_source(rng: random.Random, package: str, class_name: str, methods: int) -> str:
+    lines = [f'package {package};', '', 'import java.util.List;', '',
+             f'public class {class_name} {{']
+    for _ in range(methods):
+        name = _name(rng).replace('_', '')
+        lines += [f'    /** {rng.choice(_CJK_COMMENTS)} */',
+                  f'    public int {name}(List<Integer> values) {{',
+                  f'        return values.size() * {rng.randint(1, 99)};',
+                  '    }', '']
+    lines.append('}')
+    return '\n'.join(lines)
+
+def _write(path: str, data, binary: bool = False) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if binary:
+        with open(path, 'wb') as f:
+            f.write(data)
+    else:
+        with open(path, 'w', encoding='utf-8', newline='\n') as f:
+            f.write(data)
+
+# --- 场景生成器 ---
+# 每个生成器接收 (根目录, 随机数生成器, 规模),相同参数总是生成相同的目录树
+
+def gen_python_monorepo(root: str, rng: random.Random, scale: float) -> None:
+    """Python 单仓库:多个包、测试、文档,以及应被排除的 .venv 与 __pycache__"""
+    for p in range(max(1, int(200 * scale))):
+        pkg = f'pkg_{p:04d}'
+        base = os.path.join(root, 'packages', pkg)
+        _write(os.path.join(base, 'README.md'), f'# {pkg}\n\n{rng.choice(_CJK_COMMENTS)}\n')
+        _write(os.path.join(base, 'setup.cfg'), f'[metadata]\nname = {pkg}\nversion = 0.{p}.0\n')
+        for m in range(20):
+            _write(os.path.join(base, 'src', pkg, f'{_name(rng)}_{m}.py'), python_source(rng, rng.randint(5, 40)))
+            _write(os.path.join(base, 'src', pkg, '__pycache__', f'm{m}.cpython-312.pyc'), rng.randbytes(2048), True)
+        for t in range(5):
+            _write(os.path.join(base, 'tests', f'test_{t}.py'), python_source(rng, 5))
+    site = os.path.join(root, '.venv', 'lib', 'python3.12', 'site-packages')
+    for d in range(max(1, int(100 * scale))):
+        for m in range(20):
+            _write(os.path.join(site, f'dep_{d}', f'mod_{m}.py'), python_source(rng, 3))
+
+def gen_node_app(root: str, rng: random.Random, scale: float) -> None:
+    """以 node_modules 为主的前端应用:少量源码,大量依赖包与压缩产物"""
+    for s in range(max(1, int(500 * scale))):
+        ext = rng.choice(['.js', '.ts', '.tsx', '.css', '.json'])
+        _write(os.path.join(root, 'src', f'feature_{s % 40}', f'{_name(rng)}_{s}{ext}'), js_source(rng, rng.randint(3, 20)))
+    _write(os.path.join(root, 'package.json'), json.dumps({'name': 'app', 'version': '1.0.0'}, indent=2))
+    for d in range(max(1, int(1500 * scale))):
+        base = os.path.join(root, 'node_modules', f'dep-{d}')
+        _write(os.path.join(base, 'package.json'), json.dumps({'name': f'dep-{d}'}))
+        for m in range(10):
+            _write(os.path.join(base, 'lib', f'{m}.js'), js_source(rng, 3))
+    for b in range(max(1, int(20 * scale))):
+        _write(os.path.join(root, 'public', f'bundle_{b}.min.js'), js_source(rng, 200).replace('\n', ''))
+
+def gen_deep_java(root: str, rng: random.Random, scale: float) -> None:
+    """层级很深的 Java 包结构,以及 target/classes 下的二进制 class 文件"""
+    for c in range(max(1, int(3000 * scale))):
+        depth = rng.randint(6, 14)
+        segments = ['com', 'example'] + [rng.choice(_WORDS) for _ in range(depth)]
+        class_name = f'{_name(rng).title().replace("_", "")}{c}'
+        package = '.'.join(segments)
+        _write(os.path.join(root, 'src', 'main', 'java', *segments, f'{class_name}.java'),
+               java_source(rng, package, class_name, rng.randint(3, 25)))
+        _write(os.path.join(root, 'target', 'classes', *segments, f'{class_name}.class'),
+               b'\xca\xfe\xba\xbe' + rng.randbytes(1024), True)
+
+def gen_mixed_encodings(root: str, rng: random.Random, scale: float) -> None:
+    """多种编码混合:UTF-8、带 BOM 的 UTF-8、GB18030、UTF-16、CRLF,以及伪装成文本的二进制与大文件"""
+    for i in range(max(1, int(2000 * scale))):
+        text = python_source(rng, rng.randint(2, 30)) + '\n# ' + '中文注释' * rng.randint(1, 50) + '\n'
+        kind = i % 6
+        if kind == 0:
+            data = text.encode('utf-8')
+        elif kind == 1:
+            data = text.encode('utf-8-sig')
+        elif kind == 2:
+            data = text.encode('gb18030')
+        elif kind == 3:
+            data = text.encode('utf-16')
+        elif kind == 4:
+            data = text.replace('\n', '\r\n').encode('utf-8')
+        else:
+            data = rng.randbytes(4096)
+        _write(os.path.join(root, f'dir_{i % 50}', f'file_{i}.txt'), data, True)
+    for i in range(max(1, int(10 * scale))):
+        big = ''.join(rng.choice('编码测试数据abcdef \n') for _ in range(1024 * 1024))
+        _write(os.path.join(root, 'large', f'large_{i}.txt'), big.encode('gb18030'), True)
+
+def gen_tiny_files(root: str, rng: random.Random, scale: float) -> None:
+    """大量极小文件(规模为 1 时一百万个),主要考验发现、调度与目录树构建"""
+    count = max(1, int(1_000_000 * scale))
+    per_dir = 1000
+    for i in range(count):
+        _write(os.path.join(root, f'd{i // per_dir:04d}', f'f{i % per_dir:03d}.txt'),
+               f'{i} {rng.choice(_WORDS)}\n')
+
+SCENARIOS: Dict[str, Callable[[str, random.Random, float], None]] = {
+    'python_monorepo': gen_python_monorepo,
+    'node_app': gen_node_app,
+    'deep_java': gen_deep_java,
+    'mixed_encodings': gen_mixed_encodings,
+    'tiny_files': gen_tiny_files,
+}
+
+def ensure_scenario(workdir: str, name: str, scale: float, seed: int) -> str:
+    """生成(或复用已生成的)场景目录,返回项目根目录"""
+    root = os.path.join(workdir, f'{name}-s{scale:g}-r{seed}')
+    # 清单放在项目目录之外,不影响合并结果
+    manifest_path = root + '.manifest.json'
+    manifest = {'scenario': name, 'scale': scale, 'seed': seed, 'generator_version': GENERATOR_VERSION}
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            if json.load(f) == manifest:
+                return root
+    except (OSError, ValueError):
+        pass
+
+    if os.path.isdir(root):
+        shutil.rmtree(root)
+    print(f'生成场景 {name} (规模 {scale:g}) ...', file=sys.stderr)
+    SCENARIOS[name](root, random.Random(f'{name}:{seed}'), scale)
+    os.makedirs(workdir, exist_ok=True)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    return root
+
+# --- 单次运行(在子进程中执行) ---
+
+def run_once(root: str, workdir: str, use_cache: bool) -> dict:
+    """合并一次并写出到临时文件,返回各阶段耗时与统计;use_cache 时先预热一次,只计时第二次"""
+    options = mNc.MergeOptions(content_cache=use_cache, directory_cache=use_cache,
+                               cache_directory=os.path.join(workdir, 'cache') if use_cache else None)
+    output_path = os.path.join(workdir, f'output-{os.getpid()}.txt')
+    try:
+        for _ in range(2 if use_cache else 1):
+            start = time.perf_counter()
+            with mNc.merge([root], options) as merged, open(output_path, 'w', encoding='utf-8') as f:
+                for chunk in merged:
+                    f.write(chunk)
+            wall = time.perf_counter() - start
+        bytes_written = os.path.getsize(output_path)
+    finally:
+        try:
+            os.remove(output_path)
+        except OSError:
+            pass
+
+    summary = merged.summary
+    return {
+        'wall_seconds': wall,
+        'phases': summary.phases,
+        'peak_rss_bytes': mNc.peak_rss_bytes(),
+        'total_files': summary.total_files,
+        'text_files': summary.text_files,
+        'bytes_read': summary.bytes_read,
+        'bytes_written': bytes_written,
+        'total_chars': summary.total_chars,
+    }
+
+# --- 汇总与比较 ---
+
+def _median_run(runs: List[dict]) -> dict:
+    """多次运行取中位数(计数类字段取第一次)"""
+    result = dict(runs[0])
+    result['wall_seconds'] = statistics.median(run['wall_seconds'] for run in runs)
+    result['peak_rss_bytes'] = int(statistics.median(run['peak_rss_bytes'] for run in runs))
+    phase_names = {name for run in runs for name in run['phases']}
+    result['phases'] = {name: statistics.median(run['phases'].get(name, 0.0) for run in runs)
+                        for name in sorted(phase_names)}
+    result['repeat'] = len(runs)
+    return result
+
+def _metrics(result: dict) -> Dict[str, float]:
+    """参与比较的指标:总耗时、各阶段耗时与峰值内存"""
+    metrics = {'wall_seconds': result['wall_seconds'], 'peak_rss_bytes': result['peak_rss_bytes']}
+    metrics.update({f'phase.{name}': seconds for name, seconds in result['phases'].items()})
+    return metrics
+
+def compare_to_baseline(results: Dict[str, dict], baseline: dict, tolerance: float) -> List[str]:
+    """返回回退描述列表;相对变化超过阈值且绝对差值超过噪声下限才算回退"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('scenarios', {}).get(name)
+        if base is None:
+            continue
+        base_metrics = _metrics(base)
+        for metric, value in _metrics(result).items():
+            old = base_metrics.get(metric)
+            if not old:
+                continue
+            floor = MIN_RSS_DELTA_BYTES if metric == 'peak_rss_bytes' else MIN_SECONDS_DELTA
+            if value > old * (1 + tolerance) and value - old > floor:
+                regressions.append(f'{name}: {metric} {old:.4g} -> {value:.4g} (+{(value / old - 1) * 100:.1f}%)')
+    return regressions
+
+def print_table(results: Dict[str, dict], baseline: Optional[dict]) -> None:
+    phase_names = ['discover', 'analyze', 'assemble', 'output']
+    header = f"{'场景':<18}{'文件数':>10}{'总耗时':>10}" + ''.join(f'{name:>10}' for name in phase_names) \
+        + f"{'峰值MB':>10}{'对比基线':>12}"
+    print(header)
+    print('-' * len(header))
+    for name, result in results.items():
+        delta = ''
+        base = (baseline or {}).get('scenarios', {}).get(name)
+        if base and base.get('wall_seconds'):
+            delta = f"{(result['wall_seconds'] / base['wall_seconds'] - 1) * 100:+.1f}%"
+        row = f"{name:<18}{result['total_files']:>10,}{result['wall_seconds']:>10.3f}"
+        row += ''.join(f"{result['phases'].get(phase, 0.0):>10.3f}" for phase in phase_names)
+        row += f"{result['peak_rss_bytes'] / (1024 * 1024):>10.1f}{delta:>12}"
+        print(row)
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='mNc 端到端基准测试')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='只运行指定场景(可重复),默认全部')
+    parser.add_argument('--scale', type=float, default=0.1,
+                        help='生成规模(1.0 对应完整规模,如一百万个小文件),默认 0.1')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    parser.add_argument('--repeat', type=int, default=3, help='每个场景运行次数,结果取中位数')
+    parser.add_argument('--cache', action='store_true', help='测量持久化缓存预热后的运行')
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR, help='生成场景与临时输出的目录')
+    parser.add_argument('--baseline', metavar='FILE', help='与基线 JSON 比较')
+    parser.add_argument('--save-baseline', metavar='FILE', help='把本次结果保存为基线 JSON')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='判定为回退的相对阈值')
+    parser.add_argument('--json', metavar='FILE', help='写出本次结果 JSON')
+    parser.add_argument('--run-one', nargs=2, metavar=('ROOT', 'WORKDIR'), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main() -> int:
+    args = parse_args(sys.argv[1:])
+    if args.run_one:
+        # 子进程:只运行一次并以 JSON 输出结果,峰值内存只反映这一次运行
+        root, workdir = args.run_one
+        json.dump(run_once(root, workdir, args.cache), sys.stdout)
+        return 0
+
+    workdir = os.path.abspath(args.workdir)
+    if mNc.should_exclude_directory(workdir):
+        print(f'工作目录 {workdir} 位于 mNc 的排除路径中,请用 --workdir 指定其它目录', file=sys.stderr)
+        return 2
+
+    results: Dict[str, dict] = {}
+    for name in args.scenario or list(SCENARIOS):
+        root = ensure_scenario(workdir, name, args.scale, args.seed)
+        runs = []
+        for _ in range(args.repeat):
+            command = [sys.executable, os.path.abspath(__file__), '--run-one', root, workdir]
+            if args.cache:
+                command.append('--cache')
+            completed = subprocess.run(command, capture_output=True, text=True, check=True)
+            runs.append(json.loads(completed.stdout))
+        results[name] = _median_run(runs)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != args.scale or baseline.get('cache') != args.cache:
+            print('⚠️ 基线的规模或缓存设置与本次不同,比较结果仅供参考', file=sys.stderr)
+
+    print_table(results, baseline)
+
+    report = {
+        'scale': args.scale,
+        'seed': args.seed,
+        'cache': args.cache,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'generator_version': GENERATOR_VERSION,
+        'scenarios': results,
+    }
+    for path in (args.save_baseline, args.json):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if baseline is not None:
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print('\n❌ 性能回退:')
+            for line in regressions:
+                print(f'  - {line}')
+            return 1
+        print('\n✅ 没有超过阈值的回退')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
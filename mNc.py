@@ -1,12 +1,33 @@
 import sys
 import os
+import re
 import time
+import stat
+import queue
+import struct
+import zlib
+import json
+import bisect
+import hashlib
+import heapq
+import argparse
+import fnmatch
+import unicodedata
+import threading
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from contextlib import contextmanager, redirect_stdout
+from dataclasses import dataclass, field, replace
 from enum import Enum, auto
-from typing import List, Optional, Dict
-from collections import defaultdict
+from typing import List, Optional, Dict, Iterator, AsyncIterator, Tuple, NamedTuple, Callable, TYPE_CHECKING
+from collections import defaultdict, deque, OrderedDict
+
+# sqlite3、lzma、asyncio、multiprocessing、tracemalloc、cProfile 等导入较慢(shutil / tempfile 会间接导入 lzma),
+# 只在用到它们的功能(缓存、溢写、异步接口、进程池、常驻进程、性能分析)中导入,普通运行不承担这部分启动时间
+if TYPE_CHECKING:
+    import pstats
+    import sqlite3
+    from concurrent.futures import ProcessPoolExecutor
 
 # 尝试导入 pyperclip,如果失败则设置标记
 try:
@@ -20,12 +41,101 @@ except ImportError:
 # [显示配置]
 # 实时输出时,用于显示文件路径的最大字符长度。超过此长度的路径中间会显示为...
 MAX_PATH_DISPLAY_LEN = 80
+# 进度行在终端中的刷新间隔(秒);输出被重定向到文件/管道时,改为每隔 PROGRESS_LOG_SECONDS 秒输出一行
+PROGRESS_REFRESH_SECONDS = 0.2
+PROGRESS_LOG_SECONDS = 5.0
+# 文件耗时报告(-v / --profile / JSON 报告)中最慢、最大文件各列出的数量
+REPORT_TOP_FILES = 10
+
+# [指标输出]
+# --metrics-file 写出的 Prometheus 直方图分桶上限:文件大小(字节)与单个文件的读取耗时(秒)
+METRICS_SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+METRICS_READ_SECONDS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
 
 # [文件过滤]
 # 定义单个文件的最大体积(20MB)。超过此大小的文件将被直接跳过,不进行任何读取或分析。
 # 目的是为了防止因意外拖入超大文件(如视频、数据库)导致程序内存溢出或长时间无响应。
 MAX_FILE_SIZE_BYTES = 20 * 1024 * 1024
 
+# [文件发现]
+# 目录遍历使用的线程数。网络盘或冷缓存时,并发列目录可以显著缩短发现阶段耗时。
+DISCOVERY_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+# 发现线程与分析阶段之间的队列容量(按批次计,每个目录产出一批)。队列满时遍历线程会等待。
+DISCOVERY_QUEUE_SIZE = 256
+
+# [流水线限流]
+# 同时处于读取/待汇总状态的文件数量上限与字节数上限。
+# 边发现边读取时,用于限制内存中的 Future 数量与尚未汇总的文件内容体积。
+MAX_IN_FLIGHT_FILES = 512
+MAX_IN_FLIGHT_BYTES = 128 * 1024 * 1024
+
+# [输出组装]
+# 分析阶段最多在内存中保留的文件内容总字节数。超出部分写入临时段文件(与溢写到磁盘共用),
+# 写出时从段文件读回,不再重新读取源文件。
+CONTENT_RETAIN_LIMIT_BYTES = 64 * 1024 * 1024
+# 写出阶段按最终顺序预取文件内容的窗口大小(同时在内存中的预取文件数)
+OUTPUT_PREFETCH_WINDOW = 16
+
+# [溢写到磁盘]
+# 开启后,工作线程把解码后的内容追加写入临时段文件,结果中只保存 (偏移, 长度),
+# 合并时按最终顺序从段文件中复制。适用于内容总量超过可用内存的超大项目。
+SPILL_TO_DISK = False
+# 临时段文件所在目录,None 表示使用系统临时目录
+SPILL_DIRECTORY = None
+
+# [解码执行方式]
+# 'thread': 线程池读取与解码; 'process': 进程池,解码不受 GIL 限制,内容经各进程自己的临时段文件传回;
+# 'auto': 先用线程池,待解码的总字节数超过阈值后,把之后的较大文件交给进程池
+EXECUTOR_BACKEND = 'auto'
+# auto 模式切换到进程池的待解码总字节数阈值
+PROCESS_POOL_THRESHOLD_BYTES = 64 * 1024 * 1024
+# auto 模式下交给进程池的单个文件最小字节数,更小的文件进程间通信开销大于解码本身
+PROCESS_MIN_FILE_BYTES = 64 * 1024
+# 进程池的进程数
+PROCESS_WORKERS = os.cpu_count() or 1
+
+# [持久化内容缓存]
+# 以 (绝对路径, 大小, 修改时间, inode) 为键缓存解码后的文本与探测结果。
+# 对未修改的项目重复运行时,只需 stat 即可命中缓存,不再读取与解码文件。
+# 缓存会在磁盘上保留一份合并过的源文件内容(最多 CACHE_MAX_BYTES),因此默认关闭;
+# 可用 --cache 临时开启,或在此设为 True 始终开启。
+CONTENT_CACHE_ENABLED = False
+# 缓存目录,None 表示使用用户缓存目录(Windows: %LOCALAPPDATA%\mNc, 其它: ~/.cache/mNc)
+CACHE_DIRECTORY = None
+# 缓存总大小上限(压缩后),超出时按最近最少使用的顺序淘汰
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+# 缓存内容的压缩方式: 'zlib'(快) 或 'lzma'(压缩率高)
+CACHE_COMPRESSION = 'zlib'
+# 同时缓存每个目录的列表与排除判定,以目录修改时间校验;未变化的目录不再重新列出。
+# 默认关闭,--cache 会同时开启两种缓存
+DIRECTORY_CACHE_ENABLED = False
+
+# [监视模式]
+# --watch 模式下两次检查文件变化之间的间隔(秒)
+WATCH_INTERVAL_SECONDS = 0.5
+# 每次检查时没有 stat 信息的文件(目录列表来自缓存)在线程池中分批 stat,每批的文件数
+WATCH_STAT_BATCH = 256
+
+# [常驻进程]
+# 设为 True 后,交互式运行(拖拽启动)会先尝试把请求交给 python mNc.py --daemon 启动的常驻进程处理,
+# 复用已发现的文件、已解码的内容与已编译的排除规则;没有可用的常驻进程时在本进程处理。
+# 默认关闭,避免每次运行都先读取密钥文件并尝试连接;也可对单次运行使用 --use-daemon
+DAEMON_AUTO_CONNECT = False
+# 常驻进程最多保留的项目状态数量(按最近使用淘汰)
+DAEMON_MAX_SESSIONS = 8
+
+# [异步接口]
+# merge_async 共用的线程池大小:同一事件循环中最多同时推进的阻塞步骤数
+ASYNC_MAX_WORKERS = 8
+# merge_async 每次产出的文本段大小(字符数),减少线程池与事件循环之间的往返次数
+ASYNC_CHUNK_CHARS = 64 * 1024
+
+# [文件发现方式]
+# 'walk': 遍历文件系统; 'git': 对 git 仓库直接读取 .git/index 中的已跟踪文件列表,
+# 不进入未跟踪的构建产物,也不逐个 stat。非 git 仓库或索引无法解析时自动回退为遍历。
+# 也可在命令行中使用 --git-index 临时启用。
+DISCOVERY_BACKEND = 'walk'
+
 # [强制文本读取 / 白名单配置]
 # 强制以文本方式读取的文件后缀名列表 (白名单模式)
 # 只有在此列表中的后缀名才会被读取
@@ -152,13 +262,30 @@ EXCLUDED_PATHS = [
     '__MACOSX',
 ]
 
+# [.gitignore 支持]
+# 遍历文件系统时遵守各级 .gitignore、.git/info/exclude 与全局忽略文件(~/.config/git/ignore),
+# 被忽略的目录整个不进入。设为 False 则只使用上面的排除配置。
+RESPECT_GITIGNORE = True
+
 # [文本读取配置]
 # 文本解码尝试的编码列表(按优先级排序)
+# 文件以字节形式一次读入:纯 ASCII 内容直接解码,否则依次严格尝试以下编码,
+# 全部失败时最后以 utf-8 (errors='replace') 兜底。
 TEXT_ENCODINGS = [
-    ('utf-8-sig', 'ignore'),
-    ('gb18030', 'ignore'),
+    ('utf-8-sig', 'strict'),
+    ('gb18030', 'strict'),
 ]
 
+# [二进制探测]
+# 在完整读取之前先检查文件开头的字节数,用于识别二进制内容与 UTF-16/32 文本
+SNIFF_BYTES = 8 * 1024
+# 前缀中 NUL 字节占比超过此值(且不符合 UTF-16 特征)时判定为非文本
+BINARY_NUL_RATIO = 0.001
+# 同时要求 NUL 字节至少有这么多个:短文件中个别残留的 NUL 不会使整个文件被判为二进制(解码后会被去除)
+BINARY_MIN_NUL_COUNT = 4
+# 前缀中控制字符(制表符、换行等常见字符除外)占比超过此值时判定为非文本
+BINARY_CONTROL_RATIO = 0.05
+
 # [语言特定注释符号]
 # 用于在合并文件头部标记文件路径时使用相应语言的注释符号
 COMMENT_MARKERS = {
@@ -255,6 +382,7 @@ class Status(Enum):
     SKIPPED_EXCLUDED_PATTERN = auto() # 新增：匹配排除模式
     SKIPPED_EXCLUDED_PATH = auto()
     FAILED = auto()
+    MISSING = auto()  # 发现阶段只有 stat 提示(git 索引)、分析时已从工作区删除的文件,不产出结果
 
 @dataclass
 class ProcessResult:
@@ -262,55 +390,501 @@ class ProcessResult:
     status: Status
     content: Optional[str] = None
     error_message: Optional[str] = None
+    # 分析阶段唯一一次 stat 取得的元数据,后续生成文件头等步骤不再访问文件系统
+    size: Optional[int] = None
+    mtime_ns: Optional[int] = None
+    mode: Optional[int] = None
+    inode: Optional[int] = None
+    encoding: Optional[str] = None
+    # 溢写模式下内容在段文件中的位置(字节偏移与长度),此时 content 为 None
+    spill_offset: Optional[int] = None
+    spill_length: Optional[int] = None
+    # 由进程池工作进程写入时所在的段文件;None 表示主进程自己的段文件
+    spill_path: Optional[str] = None
+    # 分析时实际从磁盘读取的字节数(缓存命中为 0)
+    bytes_read: int = 0
+    # 解码后的字符数(溢写模式下 content 为 None,仍记录在此)
+    decoded_chars: int = 0
+    # 各步骤耗时(秒):复用发现阶段的 stat 时 stat 为 0;命中缓存时读取耗时为查缓存(含解压)的时间
+    stat_seconds: float = 0.0
+    read_seconds: float = 0.0
+    decode_seconds: float = 0.0
+
+    @property
+    def elapsed_seconds(self) -> float:
+        return self.stat_seconds + self.read_seconds + self.decode_seconds
+
+class SpillStore:
+    """只追加的临时段文件:保存解码后的文件内容,按 (偏移, 长度) 读回。
+    段文件在第一次追加时才创建,只启动进程池(segment_dir)时不会创建"""
+
+    def __init__(self, directory: Optional[str] = None):
+        self.path: Optional[str] = None
+        self._file = None
+        self._lock = threading.Lock()
+        self._end = 0
+        self._directory = directory
+        self._segment_dir: Optional[str] = None
+        self._segments: Dict[str, object] = {}  # 其它进程写入的段文件 -> 只读句柄
+
+    def append(self, text: str) -> Tuple[int, int]:
+        """追加一段文本,返回其 (偏移, 长度)"""
+        data = text.encode('utf-8', 'surrogatepass')
+        with self._lock:
+            if self._file is None:
+                import tempfile
+                fd, self.path = tempfile.mkstemp(prefix='mNc-spill-', suffix='.seg', dir=self._directory)
+                self._file = os.fdopen(fd, 'w+b')
+            offset = self._end
+            self._file.seek(offset)
+            self._file.write(data)
+            self._end += len(data)
+        return offset, len(data)
+
+    def flush(self) -> None:
+        """把缓冲区写入文件,使其它进程可以读到已追加的内容"""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def segment_dir(self) -> str:
+        """供进程池工作进程创建各自段文件的目录,随本存储一起删除"""
+        with self._lock:
+            if self._segment_dir is None:
+                import tempfile
+                self._segment_dir = tempfile.mkdtemp(prefix='mNc-segments-', dir=self._directory)
+            return self._segment_dir
+
+    def read(self, offset: int, length: int, path: Optional[str] = None) -> str:
+        """读回 append 写入的一段文本;path 指定时从工作进程的段文件中读取"""
+        with self._lock:
+            if path is None or path == self.path:
+                f = self._file
+            else:
+                f = self._segments.get(path)
+                if f is None:
+                    f = self._segments[path] = open(path, 'rb')
+            f.seek(offset)
+            data = f.read(length)
+        return data.decode('utf-8', 'surrogatepass')
+
+    def close(self) -> None:
+        """关闭并删除段文件(包括工作进程的段文件目录)"""
+        try:
+            if self._file is not None:
+                self._file.close()
+            for f in self._segments.values():
+                f.close()
+        finally:
+            if self.path is not None:
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass
+            if self._segment_dir is not None:
+                import shutil
+                shutil.rmtree(self._segment_dir, ignore_errors=True)
+
+@dataclass
+class DiscoveredFile:
+    """发现阶段产出的文件,携带遍历时已获得的 stat 信息,避免分析阶段重复 stat"""
+    path: str
+    parent_cleared: bool = False
+    stat_result: Optional[os.stat_result] = None
+    # False 表示 stat_result 只是提示(如 git 索引中缓存的值),需要读取的文件在分析时重新 stat
+    stat_verified: bool = True
+    # 没有 stat_result 时的文件大小提示(来自目录列表缓存,可能已过期),只用于在途字节数估算
+    size_hint: Optional[int] = None
+
+# --- 排除规则编译 ---
+
+_TRIE_TERMINAL = object()  # 字典树的终止标记,不会与任何路径段冲突
+
+class PathExclusionMatcher:
+    """将 EXCLUDED_PATHS 编译为路径段后缀树 + 通配符合并正则,启动时只编译一次"""
+
+    def __init__(self, excluded_paths: List[str]):
+        # 多级路径规则按"逆序路径段"存入字典树,便于从任意位置向前匹配
+        self._suffix_trie: dict = {}
+        wildcard_patterns = []
+        for excluded in excluded_paths:
+            if '*' in excluded:
+                wildcard_patterns.append(fnmatch.translate(os.path.normcase(excluded)))
+                continue
+            node = self._suffix_trie
+            for part in reversed(excluded.replace('\\', '/').split('/')):
+                node = node.setdefault(part, {})
+            node[_TRIE_TERMINAL] = True
+        # 所有通配符规则合并为一个正则,逐个路径段匹配
+        self._wildcard_regex = re.compile('|'.join(wildcard_patterns)) if wildcard_patterns else None
+
+    def _matches_ending_at(self, parts: List[str], end: int) -> bool:
+        """检查是否有规则恰好结束于 parts[end]"""
+        node = self._suffix_trie
+        for i in range(end, -1, -1):
+            node = node.get(parts[i])
+            if node is None:
+                return False
+            if _TRIE_TERMINAL in node:
+                return True
+        return False
+
+    def _matches_wildcard(self, part: str) -> bool:
+        return self._wildcard_regex is not None and self._wildcard_regex.match(os.path.normcase(part)) is not None
+
+    def matches(self, path: str, parent_cleared: bool = False) -> bool:
+        """检查路径是否命中排除规则。parent_cleared 为 True 时表示父目录已检查通过,只需检查最后一段"""
+        parts = path.replace('\\', '/').split('/')
+        if parent_cleared:
+            last = len(parts) - 1
+            return self._matches_wildcard(parts[last]) or self._matches_ending_at(parts, last)
+
+        for end in range(len(parts)):
+            if self._matches_wildcard(parts[end]) or self._matches_ending_at(parts, end):
+                return True
+        return False
+
+def compile_file_patterns(patterns: List[str]):
+    """将 EXCLUDED_FILE_PATTERNS 合并编译为一个忽略大小写的正则"""
+    if not patterns:
+        return None
+    return re.compile('|'.join(fnmatch.translate(pattern.lower()) for pattern in patterns))
+
+class FileFilter:
+    """一组过滤配置(白名单、排除路径、排除文件模式、大小上限)编译后的匹配器。
+    默认配置在导入时编译一次;MergeOptions 指定了其它配置时按需另建(见 MergeOptions.file_filter)"""
+
+    def __init__(self, allowed_extensions=None, excluded_paths=None, excluded_file_patterns=None,
+                 max_file_size_bytes: Optional[int] = None):
+        self.allowed_extensions = frozenset(FORCE_TEXT_EXTENSIONS if allowed_extensions is None
+                                            else allowed_extensions)
+        self.excluded_paths = tuple(EXCLUDED_PATHS if excluded_paths is None else excluded_paths)
+        self.excluded_file_patterns = tuple(EXCLUDED_FILE_PATTERNS if excluded_file_patterns is None
+                                            else excluded_file_patterns)
+        self.max_file_size_bytes = MAX_FILE_SIZE_BYTES if max_file_size_bytes is None else max_file_size_bytes
+        self._path_matcher = PathExclusionMatcher(list(self.excluded_paths))
+        self._file_pattern_regex = compile_file_patterns(list(self.excluded_file_patterns))
+        # 目录列表缓存中的排除判定依赖排除路径,不同配置的列表分开缓存
+        self.listing_key = hashlib.sha1(repr(self.excluded_paths).encode('utf-8')).hexdigest()
+
+    def exclude_path(self, path: str, parent_cleared: bool = False) -> bool:
+        """检查路径是否命中排除路径规则"""
+        return self._path_matcher.matches(path, parent_cleared)
+
+    def exclude_file_pattern(self, file_path: str) -> bool:
+        """检查文件名是否匹配排除模式"""
+        if self._file_pattern_regex is None:
+            return False
+        return self._file_pattern_regex.match(os.path.basename(file_path).lower()) is not None
+
+    def allows_extension(self, file_path: str) -> bool:
+        """检查文件是否在白名单中"""
+        _, ext = os.path.splitext(file_path)
+        
+        # 检查是否有扩展名
+        if not ext:
+            # 检查是否包含特殊文件名(如 Dockerfile)在白名单中
+            filename = os.path.basename(file_path)
+            if filename in self.allowed_extensions:
+                return True
+            return '*' in self.allowed_extensions
+        
+        return ext.lower() in self.allowed_extensions
+
+    def selects(self, file_path: str, parent_cleared: bool = False) -> bool:
+        """文件是否通过所有按名称的过滤(需要 stat 并读取内容)"""
+        return (not self.exclude_path(file_path, parent_cleared) and not self.exclude_file_pattern(file_path)
+                and self.allows_extension(file_path))
+
+_DEFAULT_FILTER = FileFilter()
+
+# --- 持久化缓存 ---
+
+# 缓存格式版本。解码逻辑发生不兼容变化时递增,使旧缓存自动失效
+CACHE_FORMAT_VERSION = 1
+# 目录列表缓存的数据格式版本,与内容缓存分开,修改列表格式时内容缓存仍然有效
+LISTING_FORMAT_VERSION = 2
+# 修改时间距当前不足此秒数的文件不写入缓存:同一时间戳精度内的再次修改无法通过 mtime 识别
+CACHE_RACY_WINDOW_SECONDS = 2
+# 缓存写入与访问时间更新的批量大小
+CACHE_WRITE_BATCH = 256
+# 目录列表缓存超过此天数未被访问即清理
+LISTING_MAX_AGE_DAYS = 30
+
+_SQL_PUT_CONTENT = 'INSERT OR REPLACE INTO content VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+_SQL_TOUCH_CONTENT = 'UPDATE content SET last_access = ? WHERE path = ?'
+_SQL_PUT_LISTING = 'INSERT OR REPLACE INTO listing VALUES (?, ?, ?, ?, ?)'
+_SQL_TOUCH_LISTING = 'UPDATE listing SET last_access = ? WHERE path = ?'
+
+def _lzma_compress(data: bytes) -> bytes:
+    import lzma
+    return lzma.compress(data)
+
+def _lzma_decompress(data: bytes) -> bytes:
+    """损坏的数据与 zlib 一样以 ValueError 报告,调用方不必导入 lzma"""
+    import lzma
+    try:
+        return lzma.decompress(data)
+    except lzma.LZMAError as e:
+        raise ValueError(str(e)) from e
+
+_COMPRESSORS = {
+    'zlib': (lambda data: zlib.compress(data, 1), zlib.decompress),
+    'lzma': (_lzma_compress, _lzma_decompress),
+}
+
+def get_cache_dir() -> str:
+    """获取用户缓存目录"""
+    if CACHE_DIRECTORY:
+        return CACHE_DIRECTORY
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), 'AppData', 'Local')
+    elif sys.platform == 'darwin':
+        base = os.path.join(os.path.expanduser('~'), 'Library', 'Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'mNc')
+
+class PersistentCache:
+    """基于 sqlite 的跨进程持久化缓存。任何数据库错误都只会让缓存失效,不影响正常处理"""
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: int = CACHE_MAX_BYTES,
+                 compression: str = CACHE_COMPRESSION):
+        import sqlite3
+        cache_dir = cache_dir or get_cache_dir()
+        self.db_path = os.path.join(cache_dir, 'cache.sqlite3')
+        self.max_bytes = max_bytes
+        self.compression = compression if compression in _COMPRESSORS else 'zlib'
+        # 解码相关配置变化后,旧的缓存内容不再可信
+        config = repr((CACHE_FORMAT_VERSION, TEXT_ENCODINGS, SNIFF_BYTES, BINARY_NUL_RATIO, BINARY_MIN_NUL_COUNT,
+                       BINARY_CONTROL_RATIO))
+        self.config_key = hashlib.sha1(config.encode('utf-8')).hexdigest()
+        self._lock = threading.Lock()
+        self._pending: Dict[str, List[tuple]] = defaultdict(list)  # SQL 语句 -> 待提交参数
+        # 空闲连接池:连接数只取决于同时访问缓存的线程数,线程池反复创建也不会泄漏连接
+        self._idle_connections: "queue.SimpleQueue[sqlite3.Connection]" = queue.SimpleQueue()
+        self.disabled = False
+        try:
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+            self._restrict_permissions()
+            with self._borrow() as conn:
+                self._init_schema(conn)
+        except (OSError, sqlite3.Error):
+            self.disabled = True
+
+    def _restrict_permissions(self) -> None:
+        """缓存中保存着源文件内容,数据库文件只允许当前用户读写。
+        先以 0600 创建数据库文件(sqlite 创建的 -wal / -shm 文件沿用其权限),并收紧旧版本留下的文件"""
+        os.close(os.open(self.db_path, os.O_RDWR | os.O_CREAT, 0o600))
+        for path in (self.db_path, self.db_path + '-wal', self.db_path + '-shm'):
+            try:
+                os.chmod(path, 0o600)
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def _borrow(self):
+        """从连接池借出一个连接,用完归还"""
+        import sqlite3
+        try:
+            conn = self._idle_connections.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        try:
+            yield conn
+        finally:
+            self._idle_connections.put(conn)
+
+    def _init_schema(self, conn: 'sqlite3.Connection') -> None:
+        with conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS content (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                config_key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                encoding TEXT,
+                codec TEXT NOT NULL,
+                data BLOB,
+                stored_bytes INTEGER NOT NULL,
+                last_access REAL NOT NULL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS content_lru ON content (last_access)')
+            conn.execute('''CREATE TABLE IF NOT EXISTS listing (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                config_key TEXT NOT NULL,
+                data BLOB NOT NULL,
+                last_access REAL NOT NULL)''')
+
+    def _disable(self) -> None:
+        self.disabled = True
+
+    def get_content(self, path: str, stat_result: os.stat_result):
+        """查找缓存,命中时返回 (状态, 编码, 文本),未命中返回 None"""
+        if self.disabled:
+            return None
+        import sqlite3
+        try:
+            with self._borrow() as conn:
+                row = conn.execute(
+                    'SELECT status, encoding, codec, data FROM content '
+                    'WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ? AND config_key = ?',
+                    (path, stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino, self.config_key)
+                ).fetchone()
+        except sqlite3.Error:
+            self._disable()
+            return None
+        if row is None:
+            return None
+        
+        status_name, encoding, codec, data = row
+        try:
+            status = Status[status_name]
+            text = None
+            if data is not None:
+                text = _COMPRESSORS[codec][1](data).decode('utf-8', 'surrogatepass')
+        except (KeyError, ValueError, zlib.error):
+            return None
+        
+        self._queue(_SQL_TOUCH_CONTENT, (time.time(), path))
+        return status, encoding, text
+
+    def put_content(self, path: str, stat_result: os.stat_result, status: Status,
+                    encoding: Optional[str], text: Optional[str]) -> None:
+        """写入缓存(批量提交)"""
+        if self.disabled:
+            return
+        # 刚修改过的文件可能在同一时间戳内再次被修改,不缓存
+        if time.time() - stat_result.st_mtime_ns / 1e9 < CACHE_RACY_WINDOW_SECONDS:
+            return
+        data = None
+        if text is not None:
+            data = _COMPRESSORS[self.compression][0](text.encode('utf-8', 'surrogatepass'))
+        stored_bytes = len(path) + (len(data) if data is not None else 0)
+        self._queue(_SQL_PUT_CONTENT, (path, stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino,
+                                       self.config_key, status.name, encoding, self.compression, data,
+                                       stored_bytes, time.time()))
+
+    def get_listing(self, dir_path: str, mtime_ns: int, filter_key: str):
+        """查找目录列表缓存,命中时返回 ([(文件名, 大小或 None), ...], [(子目录名, 标记), ...]),未命中返回 None。
+        filter_key 为生成列表时所用过滤配置的 FileFilter.listing_key"""
+        if self.disabled:
+            return None
+        import sqlite3
+        try:
+            with self._borrow() as conn:
+                row = conn.execute(
+                    'SELECT data FROM listing WHERE path = ? AND mtime_ns = ? AND config_key = ?',
+                    (dir_path, mtime_ns, f'{LISTING_FORMAT_VERSION}:{filter_key}')
+                ).fetchone()
+        except sqlite3.Error:
+            self._disable()
+            return None
+        if row is None:
+            return None
+        try:
+            listing = json.loads(zlib.decompress(row[0]))
+        except (ValueError, zlib.error):
+            return None
+        self._queue(_SQL_TOUCH_LISTING, (time.time(), dir_path))
+        return listing['files'], listing['dirs']
+
+    def put_listing(self, dir_path: str, mtime_ns: int, filter_key: str,
+                    file_entries: List[tuple], dirs: List[tuple]) -> None:
+        """写入目录列表缓存(批量提交);file_entries 为 [(文件名, 大小或 None), ...]"""
+        if self.disabled:
+            return
+        # 刚修改过的目录可能在同一时间戳内再次变化,不缓存
+        if time.time() - mtime_ns / 1e9 < CACHE_RACY_WINDOW_SECONDS:
+            return
+        data = zlib.compress(json.dumps({'files': file_entries, 'dirs': dirs}).encode('utf-8'), 1)
+        self._queue(_SQL_PUT_LISTING, (dir_path, mtime_ns, f'{LISTING_FORMAT_VERSION}:{filter_key}', data, time.time()))
+
+    def _queue(self, sql: str, params: tuple) -> None:
+        with self._lock:
+            pending = self._pending[sql]
+            pending.append(params)
+            should_flush = len(pending) >= CACHE_WRITE_BATCH
+        if should_flush:
+            self.flush()
+
+    def flush(self) -> None:
+        """提交积累的写入与访问时间更新"""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(list)
+        if self.disabled or not pending:
+            return
+        import sqlite3
+        try:
+            with self._borrow() as conn, conn:
+                # 先写入再更新访问时间
+                for sql in (_SQL_PUT_CONTENT, _SQL_PUT_LISTING, _SQL_TOUCH_CONTENT, _SQL_TOUCH_LISTING):
+                    if pending.get(sql):
+                        conn.executemany(sql, pending[sql])
+        except sqlite3.Error:
+            self._disable()
+
+    def evict(self) -> None:
+        """清理过期的目录列表;内容总大小超过上限时,按最近最少使用顺序淘汰到上限的 90%"""
+        if self.disabled:
+            return
+        import sqlite3
+        try:
+            with self._borrow() as conn, conn:
+                conn.execute('DELETE FROM listing WHERE last_access < ?',
+                             (time.time() - LISTING_MAX_AGE_DAYS * 86400,))
+                total = conn.execute('SELECT COALESCE(SUM(stored_bytes), 0) FROM content').fetchone()[0]
+                if total <= self.max_bytes:
+                    return
+                target = total - int(self.max_bytes * 0.9)
+                victims = []
+                for path, stored_bytes in conn.execute(
+                        'SELECT path, stored_bytes FROM content ORDER BY last_access'):
+                    victims.append((path,))
+                    target -= stored_bytes
+                    if target <= 0:
+                        break
+                conn.executemany('DELETE FROM content WHERE path = ?', victims)
+        except sqlite3.Error:
+            self._disable()
+
+    def close(self) -> None:
+        """提交剩余写入、执行淘汰并关闭所有连接"""
+        import sqlite3
+        self.flush()
+        self.evict()
+        while True:
+            try:
+                conn = self._idle_connections.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
 
 # --- 核心逻辑函数 ---
 
-def should_exclude_path(file_path: str) -> bool:
+def should_exclude_path(file_path: str, parent_cleared: bool = False,
+                        file_filter: Optional[FileFilter] = None) -> bool:
     """检查文件路径是否应该被排除"""
-    normalized_path = file_path.replace('\\', '/')
-    path_parts = normalized_path.split('/')
-    
-    for excluded in EXCLUDED_PATHS:
-        if '*' in excluded:
-            import fnmatch
-            if any(fnmatch.fnmatch(part, excluded) for part in path_parts):
-                return True
-        else:
-            excluded_parts = excluded.split('/')
-            for i in range(len(path_parts) - len(excluded_parts) + 1):
-                if path_parts[i:i+len(excluded_parts)] == excluded_parts:
-                    return True
-    
-    return False
+    return (file_filter or _DEFAULT_FILTER).exclude_path(file_path, parent_cleared)
 
-def should_exclude_directory(dir_path: str) -> bool:
+def should_exclude_directory(dir_path: str, parent_cleared: bool = False,
+                             file_filter: Optional[FileFilter] = None) -> bool:
     """检查目录是否应该被排除(用于os.walk的目录过滤)"""
-    return should_exclude_path(dir_path)
+    return should_exclude_path(dir_path, parent_cleared, file_filter)
 
-def should_exclude_file_pattern(file_path: str) -> bool:
+def should_exclude_file_pattern(file_path: str, file_filter: Optional[FileFilter] = None) -> bool:
     """检查文件是否匹配需要排除的模式"""
-    import fnmatch
-    filename = os.path.basename(file_path)
-    
-    for pattern in EXCLUDED_FILE_PATTERNS:
-        if fnmatch.fnmatch(filename.lower(), pattern.lower()):
-            return True
-    
-    return False
+    return (file_filter or _DEFAULT_FILTER).exclude_file_pattern(file_path)
 
-def is_allowed_extension(file_path: str) -> bool:
+def is_allowed_extension(file_path: str, file_filter: Optional[FileFilter] = None) -> bool:
     """检查文件是否在允许的白名单列表中"""
-    _, ext = os.path.splitext(file_path)
-    
-    # 检查是否有扩展名
-    if not ext:
-        # 检查是否包含特殊文件名(如 Dockerfile)在白名单中
-        filename = os.path.basename(file_path)
-        if filename in FORCE_TEXT_EXTENSIONS:
-            return True
-        return '*' in FORCE_TEXT_EXTENSIONS
-    
-    return ext.lower() in FORCE_TEXT_EXTENSIONS
+    return (file_filter or _DEFAULT_FILTER).allows_extension(file_path)
 
 def get_comment_marker(file_path: str) -> str:
     """根据文件扩展名获取相应的注释符号"""
@@ -325,15 +899,14 @@ def get_comment_marker(file_path: str) -> str:
     
     return marker
 
-def format_file_header(file_path: str) -> str:
-    """格式化文件头部,使用语言特定的注释符号,并包含修改时间"""
+def format_file_header(file_path: str, mtime_ns: Optional[int] = None) -> str:
+    """格式化文件头部,使用语言特定的注释符号,并包含修改时间(来自分析阶段记录的 mtime)"""
     comment = get_comment_marker(file_path)
     separator = '=' * 60
     
-    # 获取文件修改时间
+    # 格式化文件修改时间
     try:
-        mtime = os.path.getmtime(file_path)
-        modified_time = datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S')
+        modified_time = datetime.fromtimestamp(mtime_ns / 1e9).strftime('%Y-%m-%d %H:%M:%S')
     except Exception:
         modified_time = "Unknown"
     
@@ -344,53 +917,183 @@ def format_file_header(file_path: str) -> str:
     else:
         return f"{comment} {separator}\n{comment} FILE: {file_path}\n{comment} MODIFIED: {modified_time}\n{comment} {separator}\n"
 
-def analyze_file(file_path: str) -> ProcessResult:
-    """分析单个文件,返回一个包含所有信息的 ProcessResult 对象。"""
+# 字节序标记(BOM)与对应编码。UTF-32 必须排在 UTF-16 之前,因为它们的 BOM 前缀相同
+_BOM_ENCODINGS = [
+    (b'\xff\xfe\x00\x00', 'utf-32'),
+    (b'\x00\x00\xfe\xff', 'utf-32'),
+    (b'\xff\xfe', 'utf-16'),
+    (b'\xfe\xff', 'utf-16'),
+]
+
+# 视为二进制特征的控制字符(保留 \b \t \n \v \f \r 与 ESC;NUL 由单独的规则判定)
+_CONTROL_BYTES = bytes(b for b in range(0x01, 0x20) if b not in (0x08, 0x09, 0x0a, 0x0b, 0x0c, 0x0d, 0x1b))
+
+def sniff_prefix(prefix: bytes):
+    """根据文件开头的字节判断内容类型,返回 (是否为二进制, 需要强制使用的编码或 None)"""
+    for bom, encoding in _BOM_ENCODINGS:
+        if prefix.startswith(bom):
+            return False, encoding
+    
+    if not prefix:
+        return False, None
+    
+    nul_count = prefix.count(0)
+    if nul_count:
+        # 无 BOM 的 UTF-16:ASCII 字符的高字节全为 0,NUL 集中出现在奇数位或偶数位
+        if len(prefix) >= 4:
+            even_nul = prefix[0::2].count(0)
+            odd_nul = nul_count - even_nul
+            half = len(prefix) // 2
+            if odd_nul > half * 0.7 and even_nul < half * 0.1:
+                return False, 'utf-16-le'
+            if even_nul > half * 0.7 and odd_nul < half * 0.1:
+                return False, 'utf-16-be'
+        if nul_count >= BINARY_MIN_NUL_COUNT and nul_count / len(prefix) > BINARY_NUL_RATIO:
+            return True, None
+    
+    control_count = len(prefix) - len(prefix.translate(None, _CONTROL_BYTES))
+    if control_count / len(prefix) > BINARY_CONTROL_RATIO:
+        return True, None
+    
+    return False, None
+
+def normalize_newlines(text: str) -> str:
+    """将 CRLF 与单独的 CR 统一为 LF(与文本模式的通用换行一致,不含 CR 时不做任何复制)"""
+    if '\r' not in text:
+        return text
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+def _clean_decoded(text: str) -> str:
+    """统一换行并去除残留的 NUL 字符(只处理单个文件,不再对合并结果整体复制)"""
+    if '\x00' in text:
+        text = text.replace('\x00', '')
+    return normalize_newlines(text)
+
+def decode_text_bytes(data: bytes, forced_encoding: Optional[str] = None):
+    """将文件字节解码为文本,返回 (文本, 实际使用的编码);无法解码时返回 (None, None)"""
+    # 前缀探测已确定编码(如 UTF-16):严格解码失败时以替换字符兜底
+    if forced_encoding:
+        try:
+            return _clean_decoded(data.decode(forced_encoding)), forced_encoding
+        except UnicodeError:
+            return _clean_decoded(data.decode(forced_encoding, 'replace')), forced_encoding
+    
+    # 快速路径:纯 ASCII 内容无需任何编码探测
+    if data.isascii():
+        return _clean_decoded(data.decode('ascii')), 'ascii'
+    
+    for encoding, errors in TEXT_ENCODINGS:
+        try:
+            return _clean_decoded(data.decode(encoding, errors)), encoding
+        except (UnicodeDecodeError, UnicodeError, LookupError):
+            continue
+    
+    # 如果解码失败,由于是白名单模式,通常不再强行尝试,除非确实需要
+    # 尝试最后一次强制 utf-8 替换错误
+    try:
+        return _clean_decoded(data.decode('utf-8', 'replace')), 'utf-8'
+    except Exception:
+        return None, None
+
+def _stat_metadata(stat_result: os.stat_result) -> dict:
+    """提取需要随 ProcessResult 保存的 stat 字段"""
+    return {
+        'size': stat_result.st_size,
+        'mtime_ns': stat_result.st_mtime_ns,
+        'mode': stat_result.st_mode,
+        'inode': stat_result.st_ino,
+    }
+
+def _read_and_decode(file_path: str):
+    """读取并解码文件,返回 (状态, 编码, 文本, 读取的字节数, 读取耗时, 解码耗时)"""
+    # 以字节形式读入,各编码在同一缓冲区上尝试,不再按编码重复打开文件
+    # 先读取开头一小段做二进制探测,确认是文本后才读取整个文件
+    started = time.perf_counter()
+    with open(file_path, 'rb') as f:
+        data = f.read(SNIFF_BYTES)
+        is_binary, forced_encoding = sniff_prefix(data)
+        if is_binary:
+            return Status.NON_TEXT, None, None, len(data), time.perf_counter() - started, 0.0
+        if len(data) == SNIFF_BYTES:
+            # 从头一次读入(前缀已在页缓存中),不把前缀与剩余部分拼接,避免对整个文件再复制一次
+            f.seek(0)
+            data = f.read()
+    read_done = time.perf_counter()
+    
+    content, encoding = decode_text_bytes(data, forced_encoding)
+    decode_seconds = time.perf_counter() - read_done
+    if content is None:
+        return Status.NON_TEXT, None, None, len(data), read_done - started, decode_seconds
+    return Status.TEXT_SUCCESS, encoding, content, len(data), read_done - started, decode_seconds
+
+def analyze_file(file_path: str, parent_cleared: bool = False,
+                 stat_result: Optional[os.stat_result] = None,
+                 spill_store: Optional[SpillStore] = None,
+                 content_cache: Optional[PersistentCache] = None,
+                 stat_verified: bool = True,
+                 file_filter: Optional[FileFilter] = None) -> ProcessResult:
+    """分析单个文件,返回一个包含所有信息的 ProcessResult 对象。
+    parent_cleared 表示所在目录已在遍历时通过排除检查,只需检查文件名本身;
+    stat_result 为发现阶段已取得的 stat 信息,存在且 stat_verified 时不再重复 stat;
+    spill_store 存在时内容写入段文件,结果中只保留位置;
+    content_cache 存在时先按 stat 信息查找缓存,命中则不读取文件;
+    file_filter 为使用的过滤配置,None 表示文件开头的默认配置。"""
+    file_filter = file_filter or _DEFAULT_FILTER
     try:
         # 1. 检查排除路径
-        if should_exclude_path(file_path):
+        if file_filter.exclude_path(file_path, parent_cleared):
             return ProcessResult(path=file_path, status=Status.SKIPPED_EXCLUDED_PATH)
         
         # 2. 检查排除文件模式（这些文件会出现在树中，但不读取内容）
-        if should_exclude_file_pattern(file_path):
+        if file_filter.exclude_file_pattern(file_path):
             return ProcessResult(path=file_path, status=Status.SKIPPED_EXCLUDED_PATTERN)
         
         # 3. 检查白名单 (白名单模式)
-        if not is_allowed_extension(file_path):
+        if not file_filter.allows_extension(file_path):
             return ProcessResult(path=file_path, status=Status.SKIPPED_NOT_WHITELISTED)
         
         # 4. 检查文件大小
-        if os.path.getsize(file_path) > MAX_FILE_SIZE_BYTES:
-            return ProcessResult(path=file_path, status=Status.SKIPPED_LARGE)
-
-        content = None
-        decode_success = False
-        
-        # 尝试多种编码读取文件
-        for encoding, errors in TEXT_ENCODINGS:
+        stat_seconds = 0.0
+        if stat_result is None or not stat_verified:
+            started = time.perf_counter()
             try:
-                with open(file_path, "r", encoding=encoding, errors=errors) as f:
-                    content = f.read()
-                    decode_success = True
-                    break
-            except (UnicodeDecodeError, UnicodeError):
-                continue
+                stat_result = os.stat(file_path)
+            except FileNotFoundError:
+                if stat_result is None:
+                    raise
+                return ProcessResult(path=file_path, status=Status.MISSING)
+            stat_seconds = time.perf_counter() - started
+        metadata = _stat_metadata(stat_result)
+        metadata['stat_seconds'] = stat_seconds
+        if stat_result.st_size > file_filter.max_file_size_bytes:
+            return ProcessResult(path=file_path, status=Status.SKIPPED_LARGE, **metadata)
+
+        # 5. 查找持久化缓存:命中时只用到了 stat 信息
+        started = time.perf_counter()
+        cached = content_cache.get_content(file_path, stat_result) if content_cache is not None else None
+        bytes_read = 0
+        read_seconds = time.perf_counter() - started
+        decode_seconds = 0.0
+        if cached is not None:
+            status, encoding, content = cached
+        else:
+            status, encoding, content, bytes_read, file_read_seconds, decode_seconds = _read_and_decode(file_path)
+            read_seconds += file_read_seconds
+            if content_cache is not None:
+                content_cache.put_content(file_path, stat_result, status, encoding, content)
+        metadata.update(bytes_read=bytes_read, read_seconds=read_seconds, decode_seconds=decode_seconds)
         
-        # 如果解码失败,由于是白名单模式,通常不再强行尝试,除非确实需要
-        # 但为了稳健性,如果解码完全失败(例如二进制),即使在白名单也可能无法读取
-        if not decode_success:
-            # 尝试最后一次强制 utf-8 替换错误
-            try:
-                with open(file_path, "r", encoding='utf-8', errors='replace') as f:
-                    content = f.read()
-                    decode_success = True
-            except Exception:
-                pass
+        if status != Status.TEXT_SUCCESS:
+            return ProcessResult(path=file_path, status=status, **metadata)
         
-        if not decode_success:
-            return ProcessResult(path=file_path, status=Status.NON_TEXT)
+        if spill_store is not None:
+            spill_offset, spill_length = spill_store.append(content)
+            return ProcessResult(path=file_path, status=Status.TEXT_SUCCESS, encoding=encoding,
+                                 spill_offset=spill_offset, spill_length=spill_length,
+                                 decoded_chars=len(content), **metadata)
 
-        return ProcessResult(path=file_path, status=Status.TEXT_SUCCESS, content=content)
+        return ProcessResult(path=file_path, status=Status.TEXT_SUCCESS, content=content,
+                             encoding=encoding, decoded_chars=len(content), **metadata)
 
     except (PermissionError, FileNotFoundError) as e:
         return ProcessResult(path=file_path, status=Status.FAILED, error_message=str(e))
@@ -426,33 +1129,40 @@ def get_desktop_path() -> str:
     else:
         return os.path.join(os.path.expanduser('~'), 'Desktop')
 
-def build_tree_structure(file_paths: List[str], base_path: str = None) -> str:
-    """构建目录树结构字符串"""
-    if not file_paths:
-        return ""
-    
-    # 确定基础路径
-    if base_path is None:
-        if len(file_paths) == 1:
-            base_path = os.path.dirname(file_paths[0])
-        else:
-            base_path = os.path.commonpath(file_paths)
-    
-    # 构建树形结构
-    tree_dict = {}
-    for file_path in file_paths:
-        try:
-            rel_path = os.path.relpath(file_path, base_path)
-        except ValueError:
-            rel_path = file_path
-        
-        parts = rel_path.split(os.sep)
-        current = tree_dict
-        for part in parts:
-            if part not in current:
-                current[part] = {}
-            current = current[part]
-    
+def _tree_parts(file_path: str, base_path: str) -> List[str]:
+    """计算文件相对基础路径的各级路径段"""
+    try:
+        rel_path = os.path.relpath(file_path, base_path)
+    except ValueError:
+        rel_path = file_path
+    return rel_path.split(os.sep)
+
+def tree_insert(tree_dict: dict, file_path: str, base_path: str) -> None:
+    """向树形字典中加入一个文件"""
+    current = tree_dict
+    for part in _tree_parts(file_path, base_path):
+        if part not in current:
+            current[part] = {}
+        current = current[part]
+
+def tree_remove(tree_dict: dict, file_path: str, base_path: str) -> None:
+    """从树形字典中移除一个文件,并清理因此变空的目录"""
+    parts = _tree_parts(file_path, base_path)
+    chain = [tree_dict]
+    for part in parts[:-1]:
+        child = chain[-1].get(part)
+        if not child:
+            return
+        chain.append(child)
+    chain[-1].pop(parts[-1], None)
+    # 目录只由其中的文件体现,变空的目录需要一并移除(否则会被当作文件显示)
+    for depth in range(len(parts) - 2, -1, -1):
+        if chain[depth + 1]:
+            break
+        chain[depth].pop(parts[depth], None)
+
+def render_tree(tree_dict: dict, base_path: str) -> str:
+    """将树形字典渲染为目录树字符串"""
     # 递归生成树形字符串
     def generate_tree(node: dict, prefix: str = "", is_last: bool = True) -> List[str]:
         lines = []
@@ -474,20 +1184,46 @@ def build_tree_structure(file_paths: List[str], base_path: str = None) -> str:
     
     return "\n".join(tree_lines)
 
+def compute_base_path(file_paths: List[str]) -> str:
+    """确定目录树与统计信息使用的基础路径"""
+    if len(file_paths) == 1:
+        return os.path.dirname(file_paths[0])
+    return os.path.commonpath(file_paths)
+
+def build_tree_structure(file_paths: List[str], base_path: str = None) -> str:
+    """构建目录树结构字符串"""
+    if not file_paths:
+        return ""
+    
+    # 确定基础路径
+    if base_path is None:
+        base_path = compute_base_path(file_paths)
+    
+    # 构建树形结构
+    tree_dict = {}
+    for file_path in file_paths:
+        tree_insert(tree_dict, file_path, base_path)
+    
+    return render_tree(tree_dict, base_path)
+
+def extension_key(file_path: str) -> str:
+    """统计使用的扩展名分类"""
+    _, ext = os.path.splitext(file_path)
+    return ext.lower() if ext else '[无扩展名]'
+
+def sort_extension_stats(extension_count: Dict[str, int]) -> Dict[str, int]:
+    """按数量从多到少排序扩展名统计(数量相同时按扩展名排序,与统计的累计顺序无关)"""
+    return dict(sorted(extension_count.items(), key=lambda x: (-x[1], x[0])))
+
 def analyze_file_statistics(file_paths: List[str]) -> Dict[str, int]:
     """分析文件扩展名统计"""
     extension_count = defaultdict(int)
     
     for file_path in file_paths:
-        _, ext = os.path.splitext(file_path)
-        if ext:
-            extension_count[ext.lower()] += 1
-        else:
-            extension_count['[无扩展名]'] += 1
+        extension_count[extension_key(file_path)] += 1
     
     # 按数量排序
-    sorted_stats = dict(sorted(extension_count.items(), key=lambda x: x[1], reverse=True))
-    return sorted_stats
+    return sort_extension_stats(extension_count)
 
 def is_documentation_file(file_path: str) -> bool:
     """判断是否为文档类文件(README、MD等)"""
@@ -521,204 +1257,2645 @@ def sort_files_by_priority(results: List['ProcessResult']) -> List['ProcessResul
     
     return code_files + doc_files
 
-# --- 主程序 ---
+# --- 文件发现 ---
 
-def main():
-    if len(sys.argv) < 2:
-        print("用法: 请将一个或多个文件/文件夹拖拽到 .bat 文件上。")
-        time.sleep(3)
-        return
+# 目录列表缓存中子目录的标记
+_LISTED_DIR = 0        # 需要继续遍历
+_LISTED_EXCLUDED = 1   # 命中排除规则
+_LISTED_SYMLINK = 2    # 指向目录的符号链接,不进入
 
-    print("--- 正在发现文件... ---")
-    paths_to_process = []
-    processed_paths = set()
-    for path_arg in sys.argv[1:]:
-        abs_path = os.path.abspath(path_arg)
-        if abs_path in processed_paths:
-            continue
-        
-        if os.path.isfile(abs_path):
-            processed_paths.add(abs_path)
-            paths_to_process.append(abs_path)
-        elif os.path.isdir(abs_path):
-            for root, dirs, files in os.walk(abs_path):
-                # 过滤掉应该排除的目录,避免进入遍历
-                dirs[:] = [d for d in dirs if not should_exclude_directory(os.path.join(root, d))]
+def _scan_directory(dir_path: str, descend: bool, listing_cache: Optional[PersistentCache] = None,
+                    file_filter: FileFilter = _DEFAULT_FILTER):
+    """列出单个目录,返回 (文件列表, 需要继续遍历的子目录列表)"""
+    files: List[DiscoveredFile] = []
+    subdirs: List[str] = []
+    
+    dir_mtime_ns = None
+    if listing_cache is not None:
+        try:
+            dir_mtime_ns = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            return files, subdirs
+        cached = listing_cache.get_listing(dir_path, dir_mtime_ns, file_filter.listing_key)
+        if cached is not None:
+            # 目录未变化:直接使用缓存的列表与排除判定,文件的 stat 留给分析阶段;
+            # 缓存中记录的大小(文件内容可能已变)只作为在途字节数与执行方式选择的估算
+            file_entries, dirs = cached
+            files = [DiscoveredFile(os.path.join(dir_path, name), descend, None, size_hint=size)
+                     for name, size in file_entries]
+            if descend:
+                subdirs = [os.path.join(dir_path, name) for name, flag in dirs if flag == _LISTED_DIR]
+            return files, subdirs
+    
+    file_entries: List[tuple] = []
+    dirs: List[tuple] = []
+    try:
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                
+                if is_dir:
+                    # 与 os.walk 默认行为一致:不进入指向目录的符号链接
+                    if entry.is_symlink():
+                        flag = _LISTED_SYMLINK
+                    elif file_filter.exclude_path(entry.path, True):
+                        flag = _LISTED_EXCLUDED
+                    else:
+                        flag = _LISTED_DIR
+                        if descend:
+                            subdirs.append(entry.path)
+                    dirs.append((entry.name, flag))
+                    continue
                 
-                for file_name in files:
-                    file_path = os.path.join(root, file_name)
-                    if file_path not in processed_paths:
-                        processed_paths.add(file_path)
-                        paths_to_process.append(file_path)
+                # 只 stat 通过名称过滤、需要读取的文件,其余文件在分析阶段只按名称判定。
+                # Windows 上 DirEntry.stat() 直接使用 scandir 返回的信息,无需额外系统调用
+                entry_stat = None
+                if descend and file_filter.selects(entry.path, True):
+                    try:
+                        entry_stat = entry.stat()
+                    except OSError:
+                        pass
+                files.append(DiscoveredFile(entry.path, descend, entry_stat))
+                file_entries.append((entry.name, entry_stat.st_size if entry_stat is not None else None))
+    except OSError:
+        # 与 os.walk 一致,忽略无法列出的目录
+        return files, subdirs
+    
+    if listing_cache is not None:
+        listing_cache.put_listing(dir_path, dir_mtime_ns, file_filter.listing_key, file_entries, dirs)
+    return files, subdirs
 
-    if not paths_to_process:
-        print("未找到任何文件进行处理。")
-        return
+def _list_directory(dir_path: str, ignore_stack: Optional[tuple], descend: bool,
+                    listing_cache: Optional[PersistentCache], file_filter: FileFilter):
+    """列出一个目录并应用忽略规则,返回 (文件列表, [(子目录, 子目录适用的忽略规则栈)])"""
+    files, subdirs = _scan_directory(dir_path, descend, listing_cache, file_filter)
+    # 忽略规则在列表(可能来自缓存)之上应用,不写入目录列表缓存
+    if ignore_stack is not None:
+        ignore_stack = enter_ignore_dir(ignore_stack, dir_path, files)
+        if ignore_stack:
+            files = [item for item in files if not is_ignored(ignore_stack, item.path, False)]
+            subdirs = [subdir for subdir in subdirs if not is_ignored(ignore_stack, subdir, True)]
+    return files, [(subdir, ignore_stack) for subdir in subdirs]
 
-    start_time = time.monotonic()
+def iter_directory_files(root_dir: str, max_workers: int = DISCOVERY_WORKERS,
+                         listing_cache: Optional[PersistentCache] = None,
+                         respect_gitignore: bool = RESPECT_GITIGNORE,
+                         file_filter: FileFilter = _DEFAULT_FILTER) -> Iterator[DiscoveredFile]:
+    """基于 os.scandir 的多线程目录遍历:目录放入工作队列由多个线程并发列出,文件边发现边产出"""
+    # 根目录完整检查一次,之后的子目录和文件只需检查最后一段
+    # 根目录本身被排除时只列出其直接包含的文件(它们会在分析阶段被标记为排除)
+    descend = not file_filter.exclude_path(root_dir)
+    # 每个待列出的目录携带自己适用的忽略规则栈,子目录在父目录的栈上追加自己的 .gitignore
+    root_ignore = build_ignore_stack(root_dir) if respect_gitignore else None
     
-    results: List[ProcessResult] = []
-    with ThreadPoolExecutor() as executor:
-        future_to_path = {executor.submit(analyze_file, path): path for path in paths_to_process}
-        
-        print(f"\n--- 开始处理 {len(paths_to_process)} 个文件 ---\n")
-        for future in as_completed(future_to_path):
-            res = future.result()
-            
-            # 对于排除路径的文件,不输出到控制台
-            if res.status == Status.SKIPPED_EXCLUDED_PATH:
-                results.append(res)
+    dir_queue: "queue.Queue[Optional[Tuple[str, Optional[tuple]]]]" = queue.Queue()
+    out_queue: "queue.Queue[Optional[List[DiscoveredFile]]]" = queue.Queue(DISCOVERY_QUEUE_SIZE)
+    lock = threading.Lock()
+    cancelled = threading.Event()
+    pending = [1]  # 已入队但尚未列完的目录数
+    
+    def emit(item) -> None:
+        # 队列有界:消费者停止读取后不能永久阻塞
+        while not cancelled.is_set():
+            try:
+                out_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
                 continue
-            
-            status_map = {
-                Status.TEXT_SUCCESS: "✔  成功 (文本)",
-                Status.NON_TEXT: "🖼  跳过 (非文本)",
-                Status.SKIPPED_LARGE: "🟡 跳过 (文件过大)",
-                Status.SKIPPED_NOT_WHITELISTED: "⚪ 跳过 (未在白名单)",
-                Status.SKIPPED_EXCLUDED_PATTERN: "🔸 跳过 (排除模式)",
-                Status.FAILED: f"❌ 失败 ({res.error_message})"
-            }
-            status_str = status_map.get(res.status, "未知状态")
-            
-            # 如果是白名单跳过,可以选择不打印以减少噪音,但为了明确反馈,这里还是打印
-            display_path = truncate_path(res.path, MAX_PATH_DISPLAY_LEN)
-            print(f"{display_path} ===> {status_str}")
-            
-            results.append(res)
+    
+    def worker():
+        while True:
+            task = dir_queue.get()
+            if task is None or cancelled.is_set():
+                return
+            dir_path, ignore_stack = task
+            files, subdirs = [], []
+            try:
+                files, subdirs = _list_directory(dir_path, ignore_stack, descend, listing_cache, file_filter)
+            finally:
+                with lock:
+                    pending[0] += len(subdirs)
+                for subdir_task in subdirs:
+                    dir_queue.put(subdir_task)
+                if files:
+                    emit(files)
+                with lock:
+                    pending[0] -= 1
+                    finished = pending[0] == 0
+                if finished:
+                    for _ in range(max_workers):
+                        dir_queue.put(None)
+                    emit(None)
+    
+    dir_queue.put((root_dir, root_ignore))
+    for _ in range(max_workers):
+        threading.Thread(target=_instrumented(worker, 'discover.walk'), name="mNc-discovery", daemon=True).start()
+    
+    try:
+        while True:
+            batch = out_queue.get()
+            if batch is None:
+                return
+            yield from batch
+    finally:
+        # 消费者提前结束时通知遍历线程退出
+        cancelled.set()
+        for _ in range(max_workers):
+            dir_queue.put(None)
 
-    end_time = time.monotonic()
-    total_duration = end_time - start_time
+# --- git 索引发现 ---
 
-    # --- 结果聚合与报告 ---
-    text_results = []
-    failed_files = []
-    skipped_large_files = []
-    skipped_not_whitelisted = []
-    skipped_excluded_pattern = []
-    skipped_excluded_files = []
-    non_text_files_count = 0
+class GitIndexStat(NamedTuple):
+    """git 索引条目中缓存的 stat 信息,字段名与 os.stat_result 一致以便直接替代"""
+    st_mode: int
+    st_ino: int
+    st_size: int
+    st_mtime_ns: int
 
-    for res in results:
-        if res.status == Status.TEXT_SUCCESS:
-            text_results.append(res)
-        elif res.status == Status.FAILED:
-            failed_files.append((res.path, res.error_message))
-        elif res.status == Status.SKIPPED_LARGE:
-            skipped_large_files.append(res.path)
-        elif res.status == Status.SKIPPED_NOT_WHITELISTED:
-            skipped_not_whitelisted.append(res.path)
-        elif res.status == Status.SKIPPED_EXCLUDED_PATTERN:
-            skipped_excluded_pattern.append(res.path)
-        elif res.status == Status.SKIPPED_EXCLUDED_PATH:
-            skipped_excluded_files.append(res.path)
-        else:
-            non_text_files_count += 1
-    
-    if text_results:
-        # 按优先级排序:代码文件在前,文档在后
-        sorted_results = sort_files_by_priority(text_results)
-        
-        # 生成项目统计信息
-        # 树形结构包含所有未被完全排除的文件（包括排除模式的文件）
-        all_paths_for_tree = [res.path for res in results 
-                              if res.status != Status.SKIPPED_EXCLUDED_PATH]
-        all_paths_for_content = [res.path for res in sorted_results]
-        
-        # 确定基础路径
-        if len(all_paths_for_tree) == 1:
-            base_path = os.path.dirname(all_paths_for_tree[0])
-        else:
-            base_path = os.path.commonpath(all_paths_for_tree)
-        
-        tree_structure = build_tree_structure(all_paths_for_tree, base_path)
-        file_stats = analyze_file_statistics(all_paths_for_content)
-        
-        # 构建统计信息头部
-        stats_header = "=" * 80 + "\n"
-        stats_header += "PROJECT ANALYSIS SUMMARY\n"
-        stats_header += "=" * 80 + "\n\n"
-        stats_header += f"Base Path: {base_path}\n"
-        stats_header += f"Total Files Processed: {len(all_paths_for_content)}\n"
-        stats_header += f"Total Files in Structure: {len(all_paths_for_tree)}\n"
-        stats_header += f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-        
-        stats_header += "File Type Distribution (Processed):\n"
-        stats_header += "-" * 40 + "\n"
-        for ext, count in file_stats.items():
-            stats_header += f"  {ext:20s} : {count:4d} files\n"
-        
-        stats_header += "\n" + "=" * 80 + "\n"
-        stats_header += "DIRECTORY STRUCTURE\n"
-        stats_header += "=" * 80 + "\n\n"
-        stats_header += tree_structure + "\n\n"
-        stats_header += "=" * 80 + "\n"
-        stats_header += "FILE CONTENTS\n"
-        stats_header += "=" * 80 + "\n\n"
-        
-        # 合并文件内容
-        merged_texts = [f"{format_file_header(res.path)}{res.content}\n{'-'*60}\n" 
-                       for res in sorted_results]
-        final_text = stats_header + "\n".join(merged_texts)
-        clean_text = final_text.replace('\x00', '')
-        
-        # 统计字符数
-        total_chars = len(clean_text)
-        
-        # 生成桌面文件
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        desktop_path = get_desktop_path()
-        output_file = os.path.join(desktop_path, f"{timestamp}.txt")
-        
-        try:
-            with open(output_file, 'w', encoding='utf-8') as f:
-                f.write(clean_text)
-            print(f"\n✅ 已生成文件: {output_file}")
-        except Exception as e:
-            print(f"\n❌ 文件生成失败: {e}")
-        
-        # 复制到剪贴板(如果可用)
-        if PYPERCLIP_AVAILABLE:
+_GIT_INDEX_SIGNATURE = b'DIRC'
+_GIT_MODE_TYPE_MASK = 0o170000
+_GIT_MODE_DIRECTORY = 0o040000   # 稀疏索引中的目录条目
+_GIT_MODE_GITLINK = 0o160000     # 子模块
+_GIT_FLAG_EXTENDED = 0x4000
+_GIT_EXT_FLAG_SKIP_WORKTREE = 0x4000
+# 出现这些扩展时条目列表不完整(拆分索引 / 稀疏索引),回退为遍历
+_GIT_UNSUPPORTED_EXTENSIONS = {b'link', b'sdir'}
+
+def find_git_repository(dir_path: str) -> Optional[Tuple[str, str]]:
+    """从目录向上查找 git 工作区,返回 (工作区根目录, git 目录);支持 .git 为 gitdir 文件的工作树/子模块"""
+    current = dir_path
+    while True:
+        dot_git = os.path.join(current, '.git')
+        if os.path.isdir(dot_git):
+            return current, dot_git
+        if os.path.isfile(dot_git):
             try:
-                pyperclip.copy(clean_text)
-                print("✅ 已复制到剪贴板")
-            except Exception as e:
-                print(f"⚠️  剪贴板复制失败: {e}")
-        else:
-            print("ℹ️  未安装 pyperclip 模块,跳过剪贴板复制")
-    else:
-        print("\nℹ️ 未处理任何有效文本内容。")
+                with open(dot_git, 'r', encoding='utf-8') as f:
+                    line = f.readline().strip()
+            except (OSError, UnicodeDecodeError):
+                return None
+            if not line.startswith('gitdir:'):
+                return None
+            git_dir = os.path.join(current, line[len('gitdir:'):].strip())
+            return current, os.path.normpath(git_dir)
+        parent = os.path.dirname(current)
+        if parent == current:
+            return None
+        current = parent
 
-    print("\n----- 处理报告 -----")
-    print(f"✔️  成功处理文本文件: {len(text_results)} 个")
-    print(f"📝 总字符数: {total_chars:,} 字符" if text_results else "")
-    print(f"🔩 跳过的非文本文件: {non_text_files_count} 个")
-    print(f"⏭️  因过大而跳过的文件: {len(skipped_large_files)} 个")
-    print(f"⚪  未在白名单的文件: {len(skipped_not_whitelisted)} 个")
-    print(f"🔸 匹配排除模式的文件: {len(skipped_excluded_pattern)} 个")
-    print(f"⏭️  排除路径中的文件: {len(skipped_excluded_files)} 个")
-    print(f"❌ 失败的文件或路径: {len(failed_files)} 个")
-    print(f"⏱️  总耗时: {total_duration:.2f} 秒")
-
-    if skipped_large_files:
-        print("\n跳过的大文件列表:")
-        for path in skipped_large_files:
-            print(f"  - {path}")
+def _git_common_dir(git_dir: str) -> str:
+    """工作树的 git 目录通过 commondir 指向主仓库的 git 目录(配置与 info/exclude 在那里)"""
+    try:
+        with open(os.path.join(git_dir, 'commondir'), 'r', encoding='utf-8') as f:
+            return os.path.normpath(os.path.join(git_dir, f.read().strip()))
+    except OSError:
+        return git_dir
 
-    if skipped_excluded_pattern:
-        print("\n匹配排除模式的文件列表:")
-        for path in skipped_excluded_pattern:
-            print(f"  - {path}")
+def _git_hash_size(git_dir: str) -> int:
+    """对象哈希长度:默认 SHA-1,仓库配置为 sha256 时为 32 字节"""
+    try:
+        with open(os.path.join(_git_common_dir(git_dir), 'config'), 'r', encoding='utf-8', errors='replace') as f:
+            if re.search(r'^\s*objectformat\s*=\s*sha256\s*$', f.read(), re.IGNORECASE | re.MULTILINE):
+                return 32
+    except OSError:
+        pass
+    return 20
 
-    if failed_files:
-        print("\n失败的路径列表:")
-        for path, reason in failed_files:
-            print(f"  - {path}\n    原因: {reason}")
+def _read_git_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    """读取索引 v4 路径压缩使用的变长整数,返回 (值, 新位置)"""
+    byte = data[pos]
+    pos += 1
+    value = byte & 0x7f
+    while byte & 0x80:
+        byte = data[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (byte & 0x7f)
+    return value, pos
+
+def parse_git_index(data: bytes, hash_size: int = 20) -> Optional[List[Tuple[str, GitIndexStat]]]:
+    """解析 .git/index(版本 2/3/4),返回工作区中存在的已跟踪文件 (相对路径, 缓存的 stat) 列表。
+    跳过子模块、冲突的重复阶段与 skip-worktree 条目;格式不支持或数据损坏时返回 None。"""
+    try:
+        if data[:4] != _GIT_INDEX_SIGNATURE:
+            return None
+        version, count = struct.unpack_from('>II', data, 4)
+        if version not in (2, 3, 4):
+            return None
+        
+        entries: List[Tuple[str, GitIndexStat]] = []
+        fixed_size = 40 + hash_size + 2  # 10 个 32 位 stat 字段 + 对象哈希 + 标志位
+        end = len(data) - hash_size      # 末尾为整个索引的校验和
+        pos = 12
+        prev_path = b''
+        last_added = None
+        for _ in range(count):
+            entry_start = pos
+            if pos + fixed_size > end:
+                return None
+            _, _, mtime_s, mtime_ns, _, ino, mode, _, _, size = struct.unpack_from('>10I', data, pos)
+            flags, = struct.unpack_from('>H', data, pos + 40 + hash_size)
+            pos += fixed_size
+            extended_flags = 0
+            if flags & _GIT_FLAG_EXTENDED:
+                if version < 3:
+                    return None
+                extended_flags, = struct.unpack_from('>H', data, pos)
+                pos += 2
+            
+            if version == 4:
+                # v4: 路径 = 去掉上一路径末尾 N 个字节后接上本条目的后缀,条目间无填充
+                strip, pos = _read_git_varint(data, pos)
+                nul = data.find(b'\0', pos, end)
+                if nul < 0 or strip > len(prev_path):
+                    return None
+                path = prev_path[:len(prev_path) - strip] + data[pos:nul]
+                pos = nul + 1
+            else:
+                # v2/v3: 以 NUL 结尾,整个条目用 1~8 个 NUL 填充到 8 字节对齐
+                nul = data.find(b'\0', pos, end)
+                if nul < 0:
+                    return None
+                path = data[pos:nul]
+                pos = entry_start + ((nul - entry_start + 8) & ~7)
+            prev_path = path
+            
+            mode_type = mode & _GIT_MODE_TYPE_MASK
+            if mode_type == _GIT_MODE_DIRECTORY:
+                return None
+            if mode_type == _GIT_MODE_GITLINK or extended_flags & _GIT_EXT_FLAG_SKIP_WORKTREE:
+                continue
+            # 冲突文件的多个阶段路径相同且相邻,只保留一个
+            if path == last_added:
+                continue
+            last_added = path
+            entries.append((os.fsdecode(path),
+                            GitIndexStat(mode, ino, size, mtime_s * 1_000_000_000 + mtime_ns)))
+        
+        # 扩展区:4 字节签名 + 4 字节长度
+        while pos + 8 <= end:
+            signature = data[pos:pos + 4]
+            ext_size, = struct.unpack_from('>I', data, pos + 4)
+            if signature in _GIT_UNSUPPORTED_EXTENSIONS:
+                return None
+            pos += 8 + ext_size
+        return entries
+    except (struct.error, IndexError):
+        return None
+
+def iter_git_index_files(root_dir: str,
+                         file_filter: FileFilter = _DEFAULT_FILTER) -> Optional[Iterator[DiscoveredFile]]:
+    """从 git 索引中列出 root_dir 下的已跟踪文件;不在 git 仓库中或索引无法使用时返回 None。
+    文件边解析边产出,携带索引中缓存的 stat 作为提示(stat_verified=False),发现阶段不访问工作区:
+    通过名称过滤的文件在分析时 stat 一次,已从工作区删除的文件此时被跳过(Status.MISSING);
+    未通过名称过滤的文件不会被 stat,已删除时仍会出现在目录树中。"""
+    repository = find_git_repository(root_dir)
+    if repository is None:
+        return None
+    worktree, git_dir = repository
+    try:
+        with open(os.path.join(git_dir, 'index'), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    entries = parse_git_index(data, _git_hash_size(git_dir))
+    if entries is None:
+        return None
     
-    print("--------------------")
+    rel_root = os.path.relpath(root_dir, worktree)
+    prefix = '' if rel_root == os.curdir else os.path.normcase(rel_root) + os.sep
+    
+    # 与遍历一致:根目录完整检查一次,被排除的子目录中的文件不列出
+    descend = not file_filter.exclude_path(root_dir)
+    dir_cleared: Dict[str, bool] = {root_dir: descend}
+    
+    def is_cleared(dir_path: str) -> bool:
+        cleared = dir_cleared.get(dir_path)
+        if cleared is None:
+            cleared = is_cleared(os.path.dirname(dir_path)) and not file_filter.exclude_path(dir_path, True)
+            dir_cleared[dir_path] = cleared
+        return cleared
+    
+    def iter_entries() -> Iterator[DiscoveredFile]:
+        for rel_path, index_stat in entries:
+            native_path = rel_path.replace('/', os.sep)
+            if not os.path.normcase(native_path).startswith(prefix):
+                continue
+            file_path = os.path.join(root_dir, native_path[len(prefix):])
+            dir_path = os.path.dirname(file_path)
+            if dir_path != root_dir and not is_cleared(dir_path):
+                continue
+            # 与遍历一致:不把指向目录的符号链接当作文件
+            if stat.S_ISLNK(index_stat.st_mode) and os.path.isdir(file_path):
+                continue
+            yield DiscoveredFile(file_path, descend, index_stat, stat_verified=False)
+    
+    return iter_entries()
 
-    timeout = 30 if failed_files else 5
-    print(f"\n程序将在 {timeout} 秒后自动关闭...")
-    time.sleep(timeout)
+# --- .gitignore 规则 ---
+
+@dataclass
+class IgnoreRule:
+    """一条编译后的忽略规则"""
+    regex: 're.Pattern'
+    negated: bool
+    dir_only: bool
+
+class IgnoreSpec:
+    """一个忽略文件(.gitignore / info/exclude / 全局忽略文件)编译后的匹配器,路径相对于 base_dir"""
+
+    def __init__(self, base_dir: str, rules: List[IgnoreRule]):
+        self.base_dir = base_dir
+        self.rules = rules
+        # 所有规则合并成一个正则做快速预判,绝大多数路径不匹配任何规则
+        flags = re.IGNORECASE if os.path.normcase('A') == 'a' else 0
+        self._any = re.compile('|'.join(f'(?:{rule.regex.pattern})' for rule in rules), flags)
+
+    def match(self, rel_path: str, is_dir: bool) -> Optional[bool]:
+        """最后一条匹配的规则生效:返回 True 表示忽略,False 表示被 ! 规则重新包含,None 表示没有规则匹配"""
+        if self._any.match(rel_path) is None:
+            return None
+        for rule in reversed(self.rules):
+            if rule.dir_only and not is_dir:
+                continue
+            if rule.regex.match(rel_path):
+                return not rule.negated
+        return None
+
+def _translate_ignore_pattern(pattern: str) -> str:
+    """将 gitignore 通配符转换为匹配相对路径(以 / 分隔)的正则"""
+    # 不含中间斜杠的模式在任意层级匹配文件/目录名,否则相对于忽略文件所在目录
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/') if pattern.startswith('/') else pattern
+    parts = ['' if anchored else '(?:.*/)?']
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern.startswith('**', i) and (i == 0 or pattern[i - 1] == '/') \
+                    and (i + 2 == n or pattern[i + 2] == '/'):
+                if i + 2 == n:
+                    parts.append('.*')               # 结尾的 /**: 目录下的所有内容
+                    i += 2
+                else:
+                    parts.append('(?:.*/)?')         # 开头的 **/ 或中间的 /**/: 零或多层目录
+                    i += 3
+                continue
+            while i < n and pattern[i] == '*':
+                i += 1
+            parts.append('[^/]*')
+            continue
+        if c == '?':
+            parts.append('[^/]')
+        elif c == '[':
+            end = i + 1
+            if end < n and pattern[end] in '!^':
+                end += 1
+            if end < n and pattern[end] == ']':
+                end += 1
+            end = pattern.find(']', end)
+            if end < 0:
+                parts.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body[:1] in ('!', '^'):
+                    body = '^' + body[1:]
+                parts.append('[' + body.replace('\\', '\\\\') + ']')
+                i = end
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            parts.append(re.escape(pattern[i]))
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return ''.join(parts) + r'\Z'
+
+def compile_ignore_rules(lines: List[str]) -> List[IgnoreRule]:
+    """按 gitignore 语法编译规则:注释、转义、! 取反、结尾 / 仅匹配目录、锚定与 **"""
+    flags = re.IGNORECASE if os.path.normcase('A') == 'a' else 0
+    rules: List[IgnoreRule] = []
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line or line.startswith('#'):
+            continue
+        # 去掉未转义的结尾空格
+        while line.endswith(' ') and not line.endswith('\\ '):
+            line = line[:-1]
+        negated = line.startswith('!')
+        if negated:
+            line = line[1:]
+        dir_only = line.endswith('/')
+        if dir_only:
+            line = line.rstrip('/')
+        if not line:
+            continue
+        try:
+            regex = re.compile(_translate_ignore_pattern(line), flags)
+        except re.error:
+            continue
+        rules.append(IgnoreRule(regex, negated, dir_only))
+    return rules
+
+_IGNORE_SPEC_CACHE: Dict[str, Tuple[tuple, Optional[IgnoreSpec]]] = {}
+_IGNORE_SPEC_LOCK = threading.Lock()
+
+def load_ignore_spec(file_path: str, base_dir: str) -> Optional[IgnoreSpec]:
+    """读取并编译一个忽略文件;按 (大小, 修改时间) 缓存编译结果,文件不存在或没有规则时返回 None"""
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
+        return None
+    signature = (file_stat.st_size, file_stat.st_mtime_ns, base_dir)
+    with _IGNORE_SPEC_LOCK:
+        cached = _IGNORE_SPEC_CACHE.get(file_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    try:
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            rules = compile_ignore_rules(f.readlines())
+    except OSError:
+        return None
+    spec = IgnoreSpec(base_dir, rules) if rules else None
+    with _IGNORE_SPEC_LOCK:
+        _IGNORE_SPEC_CACHE[file_path] = (signature, spec)
+    return spec
+
+def get_global_ignore_file() -> str:
+    """全局忽略文件:git 配置中的 core.excludesFile,未配置时为 $XDG_CONFIG_HOME/git/ignore"""
+    config_home = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+    for config_path in (os.path.join(os.path.expanduser('~'), '.gitconfig'),
+                        os.path.join(config_home, 'git', 'config')):
+        try:
+            with open(config_path, 'r', encoding='utf-8', errors='replace') as f:
+                match = re.search(r'^\s*excludesfile\s*=\s*(.+?)\s*$', f.read(), re.IGNORECASE | re.MULTILINE)
+        except OSError:
+            continue
+        if match:
+            return os.path.expanduser(match.group(1).strip('"'))
+    return os.path.join(config_home, 'git', 'ignore')
+
+def build_ignore_stack(root_dir: str) -> tuple:
+    """根目录的忽略规则栈(优先级从低到高):全局忽略文件、info/exclude、根目录以上各级的 .gitignore;
+    根目录及其子目录自己的 .gitignore 在遍历到时再压入"""
+    repository = find_git_repository(root_dir)
+    base_dir = repository[0] if repository is not None else root_dir
+    candidates = [(get_global_ignore_file(), base_dir)]
+    if repository is not None:
+        worktree, git_dir = repository
+        candidates.append((os.path.join(_git_common_dir(git_dir), 'info', 'exclude'), worktree))
+        ancestors = []
+        current = os.path.dirname(root_dir)
+        while len(current) >= len(worktree) and current != os.path.dirname(current):
+            ancestors.append(current)
+            if current == worktree:
+                break
+            current = os.path.dirname(current)
+        candidates.extend((os.path.join(d, '.gitignore'), d) for d in reversed(ancestors))
+    stack = (load_ignore_spec(path, base) for path, base in candidates)
+    return tuple(spec for spec in stack if spec is not None)
+
+def enter_ignore_dir(ignore_stack: tuple, dir_path: str, files: List[DiscoveredFile]) -> tuple:
+    """进入目录:目录中有 .gitignore 时把它压入规则栈"""
+    for item in files:
+        if os.path.basename(item.path) == '.gitignore':
+            spec = load_ignore_spec(item.path, dir_path)
+            return ignore_stack + (spec,) if spec is not None else ignore_stack
+    return ignore_stack
+
+def is_ignored(ignore_stack: tuple, path: str, is_dir: bool) -> bool:
+    """由深到浅查找第一个有匹配规则的忽略文件,以它的结论为准"""
+    for spec in reversed(ignore_stack):
+        prefix_len = len(spec.base_dir) + 1
+        if len(path) <= prefix_len or path[prefix_len - 1] != os.sep or not path.startswith(spec.base_dir):
+            continue
+        rel_path = path[prefix_len:]
+        if os.sep != '/':
+            rel_path = rel_path.replace(os.sep, '/')
+        result = spec.match(rel_path, is_dir)
+        if result is not None:
+            return result
+    return False
+
+def iter_input_files(path_args: List[str],
+                     listing_cache: Optional[PersistentCache] = None,
+                     backend: str = DISCOVERY_BACKEND,
+                     respect_gitignore: bool = RESPECT_GITIGNORE,
+                     file_filter: FileFilter = _DEFAULT_FILTER) -> Iterator[DiscoveredFile]:
+    """展开命令行传入的文件/文件夹,产出去重后的待处理文件;backend 为 'git' 时优先从 git 索引列出文件夹"""
+    processed_paths = set()
+    for path_arg in path_args:
+        abs_path = os.path.abspath(path_arg)
+        if abs_path in processed_paths:
+            continue
+        
+        try:
+            path_stat = os.stat(abs_path)
+        except OSError:
+            continue
+        
+        if stat.S_ISDIR(path_stat.st_mode):
+            discovered_files = iter_git_index_files(abs_path, file_filter) if backend == 'git' else None
+            if discovered_files is None:
+                discovered_files = iter_directory_files(abs_path, listing_cache=listing_cache,
+                                                        respect_gitignore=respect_gitignore,
+                                                        file_filter=file_filter)
+            for discovered in discovered_files:
+                if discovered.path not in processed_paths:
+                    processed_paths.add(discovered.path)
+                    yield discovered
+        elif stat.S_ISREG(path_stat.st_mode):
+            processed_paths.add(abs_path)
+            yield DiscoveredFile(abs_path, False, path_stat)
+
+# --- 输出组装 ---
+
+def build_stats_header(base_path: str, processed_count: int, structure_count: int,
+                       file_stats: Dict[str, int], tree_structure: str) -> str:
+    """构建输出文件开头的统计信息与目录树部分"""
+    stats_header = "=" * 80 + "\n"
+    stats_header += "PROJECT ANALYSIS SUMMARY\n"
+    stats_header += "=" * 80 + "\n\n"
+    stats_header += f"Base Path: {base_path}\n"
+    stats_header += f"Total Files Processed: {processed_count}\n"
+    stats_header += f"Total Files in Structure: {structure_count}\n"
+    stats_header += f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+    
+    stats_header += "File Type Distribution (Processed):\n"
+    stats_header += "-" * 40 + "\n"
+    for ext, count in file_stats.items():
+        stats_header += f"  {ext:20s} : {count:4d} files\n"
+    
+    stats_header += "\n" + "=" * 80 + "\n"
+    stats_header += "DIRECTORY STRUCTURE\n"
+    stats_header += "=" * 80 + "\n\n"
+    stats_header += tree_structure + "\n\n"
+    stats_header += "=" * 80 + "\n"
+    stats_header += "FILE CONTENTS\n"
+    stats_header += "=" * 80 + "\n\n"
+    return stats_header
+
+def load_result_content(result: ProcessResult, spill_store: Optional[SpillStore] = None) -> str:
+    """取得文件内容:内存中保留则直接返回,否则从段文件读回。
+    内容在分析时总是保留在内存中或写入段文件,写出时不重新读取源文件"""
+    if result.content is not None:
+        return result.content
+    if result.spill_offset is None:
+        raise ValueError(f"内容既未保留也未写入段文件: {result.path}")
+    if spill_store is None:
+        raise ValueError(f"读回已写入段文件的内容需要段文件存储: {result.path}")
+    return spill_store.read(result.spill_offset, result.spill_length, result.spill_path)
+
+def iter_file_contents(sorted_results: List[ProcessResult], window: int = OUTPUT_PREFETCH_WINDOW,
+                       spill_store: Optional[SpillStore] = None):
+    """按最终顺序产出 (结果, 内容);需要从段文件读回的内容由有界预取窗口并发加载,
+    window 为 0 时不另建线程池,在当前线程中依次加载"""
+    if window <= 0:
+        for res in sorted_results:
+            content = res.content
+            if content is None:
+                try:
+                    content = load_result_content(res, spill_store)
+                except Exception as e:
+                    content = f"[读取失败: {e}]"
+            yield res, content
+        return
+    
+    pending = deque()
+    remaining = iter(sorted_results)
+    
+    with ThreadPoolExecutor(max_workers=window) as executor:
+        def fill_window():
+            while len(pending) < window:
+                res = next(remaining, None)
+                if res is None:
+                    return
+                future = None if res.content is not None else executor.submit(_instrumented(load_result_content), res, spill_store)
+                pending.append((res, future))
+        
+        fill_window()
+        while pending:
+            res, future = pending.popleft()
+            fill_window()
+            if future is None:
+                yield res, res.content
+                continue
+            try:
+                yield res, future.result()
+            except Exception as e:
+                yield res, f"[读取失败: {e}]"
+
+def iter_output_chunks(stats_header: str, sorted_results: List[ProcessResult],
+                       spill_store: Optional[SpillStore] = None,
+                       window: int = OUTPUT_PREFETCH_WINDOW) -> Iterator[str]:
+    """按最终输出顺序逐段产出合并文本,不在内存中拼接完整结果;window 为内容预取窗口(见 iter_file_contents)"""
+    yield stats_header
+    separator = '-' * 60
+    for index, (res, content) in enumerate(iter_file_contents(sorted_results, window, spill_store)):
+        # 与 "\n".join(各文件段落) 的格式保持一致
+        yield ("\n" if index else "") + format_file_header(res.path, res.mtime_ns)
+        yield content
+        yield f"\n{separator}\n"
+
+# --- 分析流水线 ---
+
+def _estimated_read_bytes(item: DiscoveredFile, file_filter: FileFilter = _DEFAULT_FILTER) -> int:
+    """估算分析该文件需要读入的字节数,用于在途字节数限流与 auto 模式的执行方式选择"""
+    if item.stat_result is not None:
+        size = item.stat_result.st_size
+    elif item.size_hint is not None:
+        size = item.size_hint
+    elif file_filter.selects(item.path, item.parent_cleared):
+        # 没有任何大小信息(如 stat 失败)时,按一次读取的最小单位估算
+        size = SNIFF_BYTES
+    else:
+        return 0
+    if size > file_filter.max_file_size_bytes or not file_filter.allows_extension(item.path):
+        return 0
+    return size
+
+# 进程池工作进程的全局状态,由 _init_process_worker 设置
+_WORKER_STATE: Dict[str, object] = {}
+# 分析文件时用到的模块常量。spawn 方式的工作进程重新导入模块,只能看到文件中的初始值,
+# 因此启动进程池时把主进程中的当前值随初始化参数传入(调用方在运行时修改过这些常量时仍然生效)
+_WORKER_SETTINGS = ('TEXT_ENCODINGS', 'SNIFF_BYTES', 'BINARY_NUL_RATIO', 'BINARY_MIN_NUL_COUNT', 'BINARY_CONTROL_RATIO',
+                    'CACHE_RACY_WINDOW_SECONDS', 'CACHE_WRITE_BATCH')
+
+def _init_process_worker(segment_dir: str, cache_args: Optional[tuple], file_filter: FileFilter,
+                         settings: Optional[dict] = None) -> None:
+    """进程池工作进程初始化:打开自己的持久化缓存连接,段文件在第一次分析时创建。
+    过滤配置与 _WORKER_SETTINGS 中的常量随初始化参数传入,工作进程重新导入模块后仍使用主进程的配置;
+    其它常量(如显示、发现阶段的配置)不会传给工作进程"""
+    if settings:
+        globals().update(settings)
+    _WORKER_STATE['segment_dir'] = segment_dir
+    _WORKER_STATE['file_filter'] = file_filter
+    _WORKER_STATE['spill_store'] = None
+    content_cache = None
+    if cache_args is not None:
+        import multiprocessing.util
+        content_cache = PersistentCache(*cache_args)
+        # 工作进程退出时提交尚未写入的缓存记录
+        multiprocessing.util.Finalize(content_cache, content_cache.flush, exitpriority=10)
+    _WORKER_STATE['content_cache'] = content_cache
+
+def _analyze_in_process(file_path: str, parent_cleared: bool, stat_result,
+                        stat_verified: bool) -> ProcessResult:
+    """在工作进程中分析文件:文本写入本进程的段文件,只把位置传回主进程,不序列化大字符串"""
+    spill_store = _WORKER_STATE['spill_store']
+    if spill_store is None:
+        spill_store = _WORKER_STATE['spill_store'] = SpillStore(_WORKER_STATE['segment_dir'])
+    result = analyze_file(file_path, parent_cleared, stat_result, spill_store,
+                          _WORKER_STATE['content_cache'], stat_verified, _WORKER_STATE['file_filter'])
+    if result.spill_offset is not None:
+        spill_store.flush()
+        result.spill_path = spill_store.path
+    return result
+
+def _start_process_pool(spill_store: SpillStore, content_cache: Optional[PersistentCache],
+                        file_filter: FileFilter = _DEFAULT_FILTER) -> 'ProcessPoolExecutor':
+    """启动解码进程池;使用 spawn 方式,避免在已有遍历线程与数据库连接的进程中 fork"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    cache_args = None
+    if content_cache is not None and not content_cache.disabled:
+        cache_args = (os.path.dirname(content_cache.db_path), content_cache.max_bytes, content_cache.compression)
+    return ProcessPoolExecutor(PROCESS_WORKERS, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_process_worker,
+                               initargs=(spill_store.segment_dir(), cache_args, file_filter,
+                                         {name: globals()[name] for name in _WORKER_SETTINGS}))
+
+def iter_analyzed_files(discovered: Iterator[DiscoveredFile], max_workers: Optional[int] = None,
+                        spill_store: Optional[SpillStore] = None,
+                        content_cache: Optional[PersistentCache] = None,
+                        executor_backend: str = EXECUTOR_BACKEND,
+                        spill_threads: bool = SPILL_TO_DISK,
+                        file_filter: FileFilter = _DEFAULT_FILTER) -> Iterator[ProcessResult]:
+    """边发现边分析的流水线:限制同时在途的文件数与字节数,分析完成的结果立即产出。
+    spill_store 存在时可按 executor_backend 使用进程池,工作进程的段文件由它管理;
+    线程池中的结果只在 spill_threads 为 True 时写入段文件。"""
+    in_flight: Dict = {}  # Future -> 该文件计入的在途字节数
+    in_flight_bytes = 0
+    thread_spill = spill_store if spill_threads else None
+    use_processes = executor_backend == 'process' and spill_store is not None
+    decode_bytes = 0
+    process_executor: Optional[ProcessPoolExecutor] = None
+    
+    with ThreadPoolExecutor(max_workers) as executor:
+        try:
+            for item in discovered:
+                cost = _estimated_read_bytes(item, file_filter)
+                # 在途数量或字节数超限时,先等待并产出已完成的结果
+                while in_flight and (len(in_flight) >= MAX_IN_FLIGHT_FILES
+                                     or in_flight_bytes + cost > MAX_IN_FLIGHT_BYTES):
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        in_flight_bytes -= in_flight.pop(future)
+                        res = future.result()
+                        if res.status != Status.MISSING:
+                            yield res
+                
+                # auto 模式:待解码总量超过阈值后切换,之后的较大文件交给进程池
+                decode_bytes += cost
+                if (executor_backend == 'auto' and spill_store is not None and not use_processes
+                        and decode_bytes > PROCESS_POOL_THRESHOLD_BYTES):
+                    use_processes = True
+                
+                # 被排除或不在白名单中的文件只需按名称判定,在主进程中处理,不传给工作进程
+                if (use_processes and (executor_backend == 'process' or cost >= PROCESS_MIN_FILE_BYTES)
+                        and file_filter.selects(item.path, item.parent_cleared)):
+                    if process_executor is None:
+                        process_executor = _start_process_pool(spill_store, content_cache, file_filter)
+                    future = process_executor.submit(_analyze_in_process, item.path, item.parent_cleared,
+                                                     item.stat_result, item.stat_verified)
+                else:
+                    future = executor.submit(_instrumented(analyze_file), item.path, item.parent_cleared, item.stat_result,
+                                             thread_spill, content_cache, item.stat_verified, file_filter)
+                in_flight[future] = cost
+                in_flight_bytes += cost
+            
+            for future in as_completed(in_flight):
+                res = future.result()
+                if res.status != Status.MISSING:
+                    yield res
+        finally:
+            if process_executor is not None:
+                process_executor.shutdown(wait=True, cancel_futures=True)
+
+# --- 性能分析 ---
+
+class ThreadProfiler:
+    """--profile 使用的 cProfile 封装。Python 3.12 之前 cProfile 只记录启用它的线程,
+    因此每个工作线程各用一个 Profile,结束时与主线程的合并;3.12 起一个 Profile 即覆盖所有线程。
+    进程池工作进程中的调用不在统计之内。"""
+
+    def __init__(self):
+        import cProfile
+        self.main = cProfile.Profile()
+        self.per_thread = sys.version_info < (3, 12)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._thread_profiles: List[cProfile.Profile] = []
+
+    def start(self) -> None:
+        global _ACTIVE_PROFILER
+        _ACTIVE_PROFILER = self
+        self.main.enable()
+
+    def stop(self) -> None:
+        global _ACTIVE_PROFILER
+        self.main.disable()
+        _ACTIVE_PROFILER = None
+
+    def call(self, fn, *args, **kwargs):
+        """在当前线程自己的 Profile 下执行 fn"""
+        profile = getattr(self._local, 'profile', None)
+        if profile is None:
+            import cProfile
+            profile = self._local.profile = cProfile.Profile()
+            with self._lock:
+                self._thread_profiles.append(profile)
+        profile.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.disable()
+
+    def stats(self) -> 'pstats.Stats':
+        """主线程与各工作线程合并后的统计"""
+        import pstats
+        stats = pstats.Stats(self.main)
+        with self._lock:
+            for profile in self._thread_profiles:
+                try:
+                    stats.add(profile)
+                except TypeError:
+                    # 从未记录到任何调用的 Profile 无法合并
+                    pass
+        return stats
+
+_ACTIVE_PROFILER: Optional[ThreadProfiler] = None
+
+class TraceRecorder:
+    """Chrome trace event 格式的追踪记录(可用 Perfetto 或 chrome://tracing 打开):
+    每个线程一条时间线,记录工作线程中的任务与主线程上的各阶段区间"""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self._events: List[dict] = []
+        self._thread_names: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        global _ACTIVE_TRACER
+        _ACTIVE_TRACER = self
+
+    def stop(self) -> None:
+        global _ACTIVE_TRACER
+        _ACTIVE_TRACER = None
+
+    def add_span(self, name: str, category: str, start: float, end: float,
+                 args: Optional[dict] = None) -> None:
+        """记录当前线程上的一个完整区间;start/end 为 time.perf_counter() 的值"""
+        thread = threading.current_thread()
+        event = {
+            'name': name, 'cat': category, 'ph': 'X',
+            'ts': round((start - self.origin) * 1e6, 3),
+            'dur': round((end - start) * 1e6, 3),
+            'pid': self.pid, 'tid': thread.ident,
+        }
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._events.append(event)
+            self._thread_names.setdefault(thread.ident, thread.name)
+
+    def write(self, path: str) -> None:
+        """写出 JSON 追踪文件,附带进程与线程名称的元数据事件"""
+        with self._lock:
+            metadata = [{'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'args': {'name': 'mNc'}}]
+            metadata += [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}}
+                         for tid, name in self._thread_names.items()]
+            events = metadata + sorted(self._events, key=lambda event: event['ts'])
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+
+_ACTIVE_TRACER: Optional[TraceRecorder] = None
+
+def _windows_memory_counters():
+    """Windows 下当前进程的 PROCESS_MEMORY_COUNTERS"""
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                             ctypes.byref(counters), counters.cb)
+    return counters
+
+def peak_rss_bytes() -> int:
+    """当前进程的峰值常驻内存(字节)"""
+    if sys.platform == 'win32':
+        return _windows_memory_counters().PeakWorkingSetSize
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位,macOS 以字节为单位
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def current_rss_bytes() -> Optional[int]:
+    """当前进程的常驻内存(字节);无法取得时返回 None"""
+    if sys.platform == 'win32':
+        return _windows_memory_counters().WorkingSetSize
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+@dataclass
+class MemoryCheckpoint:
+    """某个阶段结束时的内存状况"""
+    phase: str
+    traced_bytes: int  # tracemalloc 记录的 Python 分配(当前)
+    traced_peak_bytes: int  # 上一个检查点以来的 Python 分配峰值
+    rss_bytes: Optional[int]
+    peak_rss_bytes: int
+    top_sites: List[Tuple[str, int, int]]  # (源码位置, 字节数, 分配次数)
+
+class MemoryProfiler:
+    """--memprofile 使用的内存分析:在每个阶段结束时取 tracemalloc 快照与 RSS。
+    tracemalloc 覆盖所有线程,但不包括进程池工作进程。"""
+
+    def __init__(self, top: int = 10):
+        import tracemalloc
+        self.top = top
+        self.checkpoints: List[MemoryCheckpoint] = []
+        # 取快照的累计耗时,PhaseTimer 从期间结束的阶段中扣除
+        self.overhead_seconds = 0.0
+        self._lock = threading.Lock()
+        # 快照中不统计 tracemalloc 自身与导入机制的分配
+        self._filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+                         tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                         tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+                         tracemalloc.Filter(False, '<unknown>')]
+
+    def start(self) -> None:
+        global _ACTIVE_MEMPROFILER
+        import tracemalloc
+        tracemalloc.start()
+        self.checkpoint('start')
+        _ACTIVE_MEMPROFILER = self
+
+    def stop(self) -> None:
+        global _ACTIVE_MEMPROFILER
+        _ACTIVE_MEMPROFILER = None
+        import tracemalloc
+        tracemalloc.stop()
+
+    def checkpoint(self, phase: str) -> float:
+        """记录当前内存状况,返回本次取快照的耗时(秒);追踪开启时记录为单独的 memprofile 区间"""
+        import tracemalloc
+        start = time.perf_counter()
+        with self._lock:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            snapshot = tracemalloc.take_snapshot().filter_traces(self._filters)
+            top_sites = [(f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", stat.size, stat.count)
+                         for stat in snapshot.statistics('lineno')[:self.top]]
+            del snapshot
+            rss = current_rss_bytes()
+            # 两种来源的采样口径略有差异,保证峰值不小于当前值
+            peak_rss = max(peak_rss_bytes(), rss or 0)
+            self.checkpoints.append(MemoryCheckpoint(phase, current, peak, rss, peak_rss, top_sites))
+            end = time.perf_counter()
+            self.overhead_seconds += end - start
+        tracer = _ACTIVE_TRACER
+        if tracer is not None:
+            tracer.add_span('memprofile', 'memprofile', start, end, {'phase': phase})
+        return end - start
+
+_ACTIVE_MEMPROFILER: Optional[MemoryProfiler] = None
+
+def print_memory_report(summary: 'MergeSummary', memprofiler: MemoryProfiler) -> None:
+    """打印各阶段结束时的内存、峰值相对输入字节数的倍数与分配最多的源码位置"""
+    checkpoints = memprofiler.checkpoints
+    if not checkpoints:
+        return
+    mb = 1024 * 1024
+    widths = [-22, 14, 14, 12, 12]
+    print("\n----- 内存分析(各阶段结束时,MB) -----")
+    print(_table_row(['阶段', 'Python 当前', 'Python 峰值', 'RSS', '峰值 RSS'], widths))
+    for point in checkpoints:
+        rss = f"{point.rss_bytes / mb:.1f}" if point.rss_bytes is not None else '-'
+        print(_table_row([point.phase, f"{point.traced_bytes / mb:.1f}", f"{point.traced_peak_bytes / mb:.1f}",
+                          rss, f"{point.peak_rss_bytes / mb:.1f}"], widths))
+    
+    traced_peak = max(point.traced_peak_bytes for point in checkpoints)
+    rss_growth = checkpoints[-1].peak_rss_bytes - checkpoints[0].peak_rss_bytes
+    print(f"\n输入文本文件合计: {summary.input_bytes / mb:.1f} MB")
+    if summary.input_bytes:
+        print(f"Python 分配峰值: {traced_peak / mb:.1f} MB = 输入的 {traced_peak / summary.input_bytes:.2f} 倍")
+        print(f"峰值 RSS 增长: {rss_growth / mb:.1f} MB = 输入的 {rss_growth / summary.input_bytes:.2f} 倍")
+    
+    # 分配最多的位置取自 Python 当前分配最大的检查点
+    heaviest = max(checkpoints, key=lambda point: point.traced_bytes)
+    print(f"\n----- 分配最多的 {len(heaviest.top_sites)} 个位置({heaviest.phase} 结束时) -----")
+    for location, size, count in heaviest.top_sites:
+        print(f"  {size / mb:>10.2f} MB{count:>10,} 次  {location}")
+
+def _trace_args(args: tuple, result) -> Optional[dict]:
+    """任务区间附带的参数:文件路径与字节数"""
+    if isinstance(result, ProcessResult):
+        return {'path': result.path, 'status': result.status.name,
+                'size': result.size, 'bytes_read': result.bytes_read}
+    if args and isinstance(args[0], ProcessResult):
+        return {'path': args[0].path, 'chars': len(result) if isinstance(result, str) else None}
+    return None
+
+def _instrumented(fn, name: Optional[str] = None):
+    """提交到工作线程的任务:性能分析开启时在该线程的 Profile 下执行,追踪开启时记录为一个区间;
+    两者都未开启时原样返回 fn"""
+    profiler = _ACTIVE_PROFILER
+    if profiler is not None and not profiler.per_thread:
+        profiler = None
+    tracer = _ACTIVE_TRACER
+    if profiler is None and tracer is None:
+        return fn
+    span_name = name or fn.__name__
+
+    def run(*args, **kwargs):
+        started = time.perf_counter()
+        result = None
+        try:
+            result = profiler.call(fn, *args, **kwargs) if profiler is not None else fn(*args, **kwargs)
+            return result
+        finally:
+            if tracer is not None:
+                tracer.add_span(span_name, 'task', started, time.perf_counter(), _trace_args(args, result))
+    return run
+
+def print_profile_report(summary: 'MergeSummary', profiler: ThreadProfiler, top: int = 25,
+                         profile_out: Optional[str] = None) -> None:
+    """打印各阶段耗时表与耗时最多的函数;profile_out 指定时写出 .prof 文件(可用 snakeviz / pstats 查看)"""
+    total = summary.duration_seconds + summary.phases.get('clipboard', 0.0)
+    print("\n----- 各阶段耗时 -----")
+    print("(discover 与 analyze 为流水线并行,assemble.* 包含在 assemble 中,output 包含写出文件的时间;"
+          "--memprofile 取快照的时间不计入各阶段,单独列为 memprofile)")
+    for name, seconds in summary.phases.items():
+        share = seconds / total * 100 if total else 0.0
+        print(f"  {name:<22}{seconds:>10.3f} 秒{share:>8.1f}%")
+    print(f"  {'total':<22}{total:>10.3f} 秒")
+    
+    import pstats
+    stats = profiler.stats()
+    print(f"\n----- 自身耗时最多的 {top} 个函数 -----")
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(top)
+    if profile_out:
+        stats.dump_stats(profile_out)
+        print(f"✅ 已写出性能分析文件: {profile_out}")
+
+# --- 合并接口 ---
+
+@dataclass
+class MergeOptions:
+    """一次合并的选项。默认值在创建实例时从文件开头的常量读取,
+    因此运行中修改常量(如 mNc.SPILL_TO_DISK = True)后新建的 MergeOptions() 会采用新值,已创建的实例不受影响"""
+    discovery_backend: str = field(default_factory=lambda: DISCOVERY_BACKEND)
+    respect_gitignore: bool = field(default_factory=lambda: RESPECT_GITIGNORE)
+    executor_backend: str = field(default_factory=lambda: EXECUTOR_BACKEND)
+    max_workers: Optional[int] = None
+    spill_to_disk: bool = field(default_factory=lambda: SPILL_TO_DISK)
+    spill_directory: Optional[str] = field(default_factory=lambda: SPILL_DIRECTORY)
+    content_cache: bool = field(default_factory=lambda: CONTENT_CACHE_ENABLED)
+    directory_cache: bool = field(default_factory=lambda: DIRECTORY_CACHE_ENABLED)
+    cache_directory: Optional[str] = field(default_factory=lambda: CACHE_DIRECTORY)
+    content_retain_limit_bytes: int = field(default_factory=lambda: CONTENT_RETAIN_LIMIT_BYTES)
+    # 过滤配置:白名单、排除路径、排除文件模式与单文件大小上限
+    allowed_extensions: frozenset = field(default_factory=lambda: frozenset(FORCE_TEXT_EXTENSIONS))
+    excluded_paths: Tuple[str, ...] = field(default_factory=lambda: tuple(EXCLUDED_PATHS))
+    excluded_file_patterns: Tuple[str, ...] = field(default_factory=lambda: tuple(EXCLUDED_FILE_PATTERNS))
+    max_file_size_bytes: int = field(default_factory=lambda: MAX_FILE_SIZE_BYTES)
+
+    def file_filter(self) -> FileFilter:
+        """按本选项的过滤配置取得编译好的匹配器,相同配置复用同一个实例"""
+        return get_file_filter(frozenset(self.allowed_extensions), tuple(self.excluded_paths),
+                               tuple(self.excluded_file_patterns), self.max_file_size_bytes)
+
+_FILE_FILTERS: Dict[tuple, FileFilter] = {}
+_FILE_FILTERS_LOCK = threading.Lock()
+
+def get_file_filter(allowed_extensions: frozenset, excluded_paths: Tuple[str, ...],
+                    excluded_file_patterns: Tuple[str, ...], max_file_size_bytes: int) -> FileFilter:
+    """取得(必要时编译)指定过滤配置的匹配器;与默认配置相同时直接返回默认匹配器"""
+    key = (allowed_extensions, excluded_paths, excluded_file_patterns, max_file_size_bytes)
+    default = _DEFAULT_FILTER
+    if key == (default.allowed_extensions, default.excluded_paths,
+               default.excluded_file_patterns, default.max_file_size_bytes):
+        return default
+    with _FILE_FILTERS_LOCK:
+        file_filter = _FILE_FILTERS.get(key)
+        if file_filter is None:
+            file_filter = _FILE_FILTERS[key] = FileFilter(*key)
+        return file_filter
+
+class PhaseTimer:
+    """按名称累计各阶段耗时(秒);发现与分析是流水线并行的,阶段之间可以重叠"""
+
+    def __init__(self, phases: Optional[Dict[str, float]] = None):
+        self.phases = phases if phases is not None else {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name: str):
+        # --memprofile 的快照耗时不计入阶段:扣除本阶段期间(如嵌套阶段结束时)取快照的耗时,
+        # 本阶段结束时的快照在计时之后进行,全部快照耗时单独记为 memprofile
+        memprofiler = _ACTIVE_MEMPROFILER
+        overhead_before = memprofiler.overhead_seconds if memprofiler is not None else 0.0
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            overhead = memprofiler.overhead_seconds - overhead_before if memprofiler is not None else 0.0
+            self.add(name, end - start - overhead)
+            tracer = _ACTIVE_TRACER
+            if tracer is not None:
+                tracer.add_span(name, 'phase', start, end)
+            memprofiler = _ACTIVE_MEMPROFILER
+            if memprofiler is not None:
+                self.add('memprofile', memprofiler.checkpoint(name))
+
+    def iterate(self, name: str, iterable):
+        """逐个产出 iterable 的元素,把从开始到耗尽(或提前关闭)的时间记为一个阶段"""
+        with self.phase(name):
+            yield from iterable
+
+def open_spill_store(options: MergeOptions) -> SpillStore:
+    """创建段文件存储:溢写模式、进程池传回的内容以及超过保留上限的内容都写入其中。
+    段文件与工作进程的段文件目录都在第一次使用时才创建,用不到时不产生任何文件"""
+    return SpillStore(options.spill_directory)
+
+def open_cache(options: MergeOptions) -> Optional[PersistentCache]:
+    """按选项打开持久化缓存(内容缓存与目录列表缓存共用一个数据库)"""
+    if options.content_cache or options.directory_cache:
+        return PersistentCache(options.cache_directory)
+    return None
+
+class ContentRetainer:
+    """限制分析阶段在内存中保留的文件内容总量:超出上限后的内容写入段文件,结果中只保留位置。
+    每个文件的内容要么保留在内存中,要么写入段文件,都与分析时读到的一致;
+    写出时不再读取源文件(源文件可能已被修改,与文件头中的元数据不符)。
+    没有段文件存储时不设上限,全部保留在内存中"""
+
+    def __init__(self, limit_bytes: int, spill_store: Optional[SpillStore] = None):
+        self.limit_bytes = limit_bytes
+        self.spill_store = spill_store
+        self.retained_bytes = 0
+        # merge_async 在各工作线程中调用 admit
+        self._lock = threading.Lock()
+
+    def admit(self, res: ProcessResult) -> ProcessResult:
+        """按上限保留或溢写 res 的内容,返回 res"""
+        if res.content is None:
+            return res
+        with self._lock:
+            retain = self.spill_store is None or self.retained_bytes + (res.size or 0) <= self.limit_bytes
+            if retain:
+                self.retained_bytes += res.size or 0
+        if retain:
+            return res
+        res.spill_offset, res.spill_length = self.spill_store.append(res.content)
+        res.content = None
+        return res
+
+def iter_merge_results(path_args: List[str], options: MergeOptions,
+                       spill_store: Optional[SpillStore] = None,
+                       cache: Optional[PersistentCache] = None,
+                       timer: Optional[PhaseTimer] = None) -> Iterator[ProcessResult]:
+    """发现并分析输入,按完成顺序产出结果;内存中保留的内容超过上限后写入 spill_store(见 ContentRetainer)"""
+    retainer = ContentRetainer(options.content_retain_limit_bytes, spill_store)
+    file_filter = options.file_filter()
+    discovered = iter_input_files(path_args, cache if options.directory_cache else None,
+                                  options.discovery_backend, options.respect_gitignore, file_filter)
+    if timer is not None:
+        discovered = timer.iterate('discover', discovered)
+    for res in iter_analyzed_files(discovered, options.max_workers, spill_store,
+                                   cache if options.content_cache else None,
+                                   options.executor_backend, options.spill_to_disk, file_filter):
+        retainer.admit(res)
+        yield res
+
+def prepare_output(results: List[ProcessResult],
+                   timer: Optional[PhaseTimer] = None) -> Optional[Tuple[str, List[ProcessResult], str]]:
+    """由全部结果生成统计头并确定文件输出顺序,返回 (统计头, 排序后的文本结果, 基础路径);没有文本文件时返回 None"""
+    timer = timer or PhaseTimer()
+    text_results = [res for res in results if res.status == Status.TEXT_SUCCESS]
+    if not text_results:
+        return None
+    # 按优先级排序:代码文件在前,文档在后
+    with timer.phase('assemble.sort'):
+        sorted_results = sort_files_by_priority(text_results)
+    
+    # 树形结构包含所有未被完全排除的文件（包括排除模式的文件）
+    all_paths_for_tree = [res.path for res in results if res.status != Status.SKIPPED_EXCLUDED_PATH]
+    all_paths_for_content = [res.path for res in sorted_results]
+    
+    with timer.phase('assemble.tree'):
+        base_path = compute_base_path(all_paths_for_tree)
+        tree_structure = build_tree_structure(all_paths_for_tree, base_path)
+    with timer.phase('assemble.statistics'):
+        file_stats = analyze_file_statistics(all_paths_for_content)
+    stats_header = build_stats_header(base_path, len(all_paths_for_content), len(all_paths_for_tree),
+                                      file_stats, tree_structure)
+    return stats_header, sorted_results, base_path
+
+@dataclass
+class MergeSummary:
+    """一次合并的结构化摘要:分析完成后各计数即完整,输出文本段全部产出后 total_chars 与 duration_seconds 完整"""
+    base_path: Optional[str] = None
+    total_files: int = 0
+    text_files: int = 0
+    status_counts: Dict[str, int] = field(default_factory=dict)  # Status 名称 -> 文件数
+    skipped_large: List[str] = field(default_factory=list)
+    skipped_excluded_pattern: List[str] = field(default_factory=list)
+    failed: List[Tuple[str, str]] = field(default_factory=list)  # (路径, 原因)
+    total_chars: int = 0
+    bytes_read: int = 0  # 分析阶段实际从磁盘读取的源文件字节数
+    input_bytes: int = 0  # 参与合并的文本文件大小合计
+    phases: Dict[str, float] = field(default_factory=dict)  # 阶段名 -> 耗时(秒)
+    analysis_seconds: float = 0.0
+    duration_seconds: float = 0.0
+    completed: bool = False
+    # 逐文件耗时统计:分析阶段最慢、最大的 REPORT_TOP_FILES 个文件(降序)与按扩展名的合计
+    slowest_files: List[ProcessResult] = field(default_factory=list)
+    largest_files: List[ProcessResult] = field(default_factory=list)
+    extension_totals: Dict[str, 'ExtensionTotals'] = field(default_factory=dict)
+    # 文件大小(不含排除路径中的文件)与读取耗时(实际读取或查缓存的文件)的分布
+    size_histogram: 'Histogram' = field(default_factory=lambda: Histogram(METRICS_SIZE_BUCKETS))
+    read_seconds_histogram: 'Histogram' = field(default_factory=lambda: Histogram(METRICS_READ_SECONDS_BUCKETS))
+
+    def count(self, status: Status) -> int:
+        return self.status_counts.get(status.name, 0)
+
+class Histogram:
+    """固定分桶的直方图,counts[i] 为落在第 i 个桶(不超过 buckets[i])内的观测数,最后一项为超出所有分桶的数量"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[int]:
+        """各分桶上限对应的累计数量(不含 +Inf)"""
+        totals, running = [], 0
+        for count in self.counts[:-1]:
+            running += count
+            totals.append(running)
+        return totals
+
+@dataclass
+class ExtensionTotals:
+    """同一扩展名文件的分析合计"""
+    files: int = 0
+    bytes_read: int = 0
+    decoded_chars: int = 0
+    seconds: float = 0.0
+
+class FileTimingCollector:
+    """按完成顺序收集逐文件耗时,只保留最慢/最大的 top 个结果,不额外持有全部结果"""
+
+    def __init__(self, top: int = REPORT_TOP_FILES):
+        self.top = top
+        self._slowest: List[Tuple[float, int, ProcessResult]] = []
+        self._largest: List[Tuple[int, int, ProcessResult]] = []
+        self._seq = 0
+        self.extension_totals: Dict[str, ExtensionTotals] = {}
+        self.size_histogram = Histogram(METRICS_SIZE_BUCKETS)
+        self.read_seconds_histogram = Histogram(METRICS_READ_SECONDS_BUCKETS)
+
+    def add(self, res: ProcessResult) -> None:
+        # 排除路径中的文件未做任何分析,不计入统计
+        if res.status == Status.SKIPPED_EXCLUDED_PATH:
+            return
+        ext = extension_key(res.path)
+        totals = self.extension_totals.get(ext)
+        if totals is None:
+            totals = self.extension_totals[ext] = ExtensionTotals()
+        totals.files += 1
+        totals.bytes_read += res.bytes_read
+        totals.decoded_chars += res.decoded_chars
+        totals.seconds += res.elapsed_seconds
+        
+        self._seq += 1
+        self._push(self._slowest, (res.elapsed_seconds, self._seq, res))
+        if res.size is not None:
+            self.size_histogram.observe(res.size)
+            if res.status in (Status.TEXT_SUCCESS, Status.NON_TEXT):
+                self.read_seconds_histogram.observe(res.read_seconds)
+        # 超过大小上限的文件已单独列出,这里只看实际参与分析的文件
+        if res.size is not None and res.status != Status.SKIPPED_LARGE:
+            self._push(self._largest, (res.size, self._seq, res))
+
+    def _push(self, heap: list, item: tuple) -> None:
+        if len(heap) < self.top:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+
+    def fill(self, summary: MergeSummary) -> None:
+        # 摘要只保留元数据与耗时,不持有文件内容
+        summary.slowest_files = [replace(res, content=None) for _, _, res in sorted(self._slowest, reverse=True)]
+        summary.largest_files = [replace(res, content=None) for _, _, res in sorted(self._largest, reverse=True)]
+        summary.extension_totals = dict(sorted(self.extension_totals.items(),
+                                               key=lambda item: item[1].seconds, reverse=True))
+        summary.size_histogram = self.size_histogram
+        summary.read_seconds_histogram = self.read_seconds_histogram
+
+class ResultCollector:
+    """按完成顺序把分析结果计入 MergeSummary,并保留全部结果供输出组装使用"""
+
+    def __init__(self, summary: MergeSummary):
+        self.summary = summary
+        self.results: List[ProcessResult] = []
+        self.timings = FileTimingCollector()
+
+    def add(self, res: ProcessResult) -> None:
+        summary = self.summary
+        self.results.append(res)
+        self.timings.add(res)
+        summary.bytes_read += res.bytes_read
+        if res.status == Status.TEXT_SUCCESS:
+            summary.input_bytes += res.size or 0
+        summary.status_counts[res.status.name] = summary.status_counts.get(res.status.name, 0) + 1
+        if res.status == Status.SKIPPED_LARGE:
+            summary.skipped_large.append(res.path)
+        elif res.status == Status.SKIPPED_EXCLUDED_PATTERN:
+            summary.skipped_excluded_pattern.append(res.path)
+        elif res.status == Status.FAILED:
+            summary.failed.append((res.path, res.error_message))
+
+    def finish(self, start_time: float) -> None:
+        """分析结束时补全计数与耗时统计"""
+        summary = self.summary
+        summary.total_files = len(self.results)
+        summary.text_files = summary.count(Status.TEXT_SUCCESS)
+        self.timings.fill(summary)
+        summary.analysis_seconds = time.monotonic() - start_time
+
+class MergeResult:
+    """merge() 的返回值:迭代得到按最终顺序排列的输出文本段,summary 随迭代更新。
+    可作为上下文管理器使用,提前退出时释放缓存与段文件。"""
+
+    def __init__(self, paths: List[str], options: Optional[MergeOptions] = None,
+                 on_result: Optional[Callable[[ProcessResult], None]] = None):
+        self.options = options or MergeOptions()
+        self.summary = MergeSummary()
+        self._chunks = self._run(list(paths), on_result)
+
+    def __iter__(self) -> 'MergeResult':
+        return self
+
+    def __next__(self) -> str:
+        return next(self._chunks)
+
+    def __enter__(self) -> 'MergeResult':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """停止合并并释放资源"""
+        self._chunks.close()
+
+    def _run(self, paths: List[str], on_result) -> Iterator[str]:
+        start_time = time.monotonic()
+        summary = self.summary
+        timer = PhaseTimer(summary.phases)
+        spill_store = open_spill_store(self.options)
+        cache = open_cache(self.options)
+        try:
+            collector = ResultCollector(summary)
+            for res in timer.iterate('analyze', iter_merge_results(paths, self.options, spill_store, cache, timer)):
+                if on_result is not None:
+                    on_result(res)
+                collector.add(res)
+            collector.finish(start_time)
+            
+            with timer.phase('assemble'):
+                prepared = prepare_output(collector.results, timer)
+            if prepared is not None:
+                stats_header, sorted_results, summary.base_path = prepared
+                # 输出阶段包含调用方处理(写出)文本段的时间
+                for chunk in timer.iterate('output', iter_output_chunks(stats_header, sorted_results, spill_store)):
+                    summary.total_chars += len(chunk)
+                    yield chunk
+            summary.completed = True
+        finally:
+            summary.duration_seconds = time.monotonic() - start_time
+            if spill_store is not None:
+                spill_store.close()
+            if cache is not None:
+                cache.close()
+
+def merge(paths: List[str], options: Optional[MergeOptions] = None,
+          on_result: Optional[Callable[[ProcessResult], None]] = None) -> MergeResult:
+    """合并文件/文件夹,不打印、不写文件、不访问剪贴板。
+    返回的对象可迭代得到输出文本段,迭代结束后 .summary 为完整的结果摘要;
+    on_result 在每个文件分析完成时被调用(按完成顺序)。"""
+    return MergeResult(paths, options, on_result)
+
+_ASYNC_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_ASYNC_EXECUTOR_LOCK = threading.Lock()
+_CHUNKS_DONE = object()
+
+def _get_async_executor() -> ThreadPoolExecutor:
+    """merge_async 共用的有界线程池,首次使用时创建"""
+    global _ASYNC_EXECUTOR
+    with _ASYNC_EXECUTOR_LOCK:
+        if _ASYNC_EXECUTOR is None:
+            _ASYNC_EXECUTOR = ThreadPoolExecutor(ASYNC_MAX_WORKERS, thread_name_prefix='mNc-async')
+        return _ASYNC_EXECUTOR
+
+def _next_chunk_batch(chunks: Iterator[str], limit: int):
+    """从同步生成器中取出若干文本段,合并到约 limit 个字符;生成器结束时返回 _CHUNKS_DONE"""
+    parts = []
+    size = 0
+    for chunk in chunks:
+        parts.append(chunk)
+        size += len(chunk)
+        if size >= limit:
+            break
+    return ''.join(parts) if parts else _CHUNKS_DONE
+
+def _analyze_and_admit(retainer: ContentRetainer, *args) -> ProcessResult:
+    """merge_async 的分析步骤:分析文件并在同一工作线程中按保留上限处理内容,溢写不占用事件循环"""
+    return retainer.admit(analyze_file(*args))
+
+def _release_async_merge(futures: list, chunks: Optional[Iterator[str]],
+                         spill_store: Optional[SpillStore], cache: Optional[PersistentCache]) -> None:
+    """等待已开始执行的步骤结束后关闭输出生成器并释放段文件与缓存(生成器不能在另一线程执行时关闭)"""
+    wait(futures)
+    if chunks is not None:
+        chunks.close()
+    if spill_store is not None:
+        spill_store.close()
+    if cache is not None:
+        cache.close()
+
+async def _aiter_directory_files(root_dir: str, executor: ThreadPoolExecutor,
+                                 listing_cache: Optional[PersistentCache] = None,
+                                 respect_gitignore: bool = RESPECT_GITIGNORE,
+                                 file_filter: FileFilter = _DEFAULT_FILTER) -> AsyncIterator[DiscoveredFile]:
+    """iter_directory_files 的异步版本:每个目录的列出是 executor 中的一个步骤,不另起遍历线程"""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    descend = not file_filter.exclude_path(root_dir)
+    root_ignore = None
+    if respect_gitignore:
+        root_ignore = await loop.run_in_executor(executor, build_ignore_stack, root_dir)
+    
+    def submit(dir_path: str, ignore_stack: Optional[tuple]):
+        return loop.run_in_executor(executor, _instrumented(_list_directory, 'discover.walk'),
+                                    dir_path, ignore_stack, descend, listing_cache, file_filter)
+    
+    pending = {submit(root_dir, root_ignore)}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                for subdir, ignore_stack in subdirs:
+                    pending.add(submit(subdir, ignore_stack))
+                for item in files:
+                    yield item
+    finally:
+        for future in pending:
+            future.cancel()
+
+def _list_git_index_files(root_dir: str, file_filter: FileFilter) -> Optional[List[DiscoveredFile]]:
+    """在工作线程中完整解析 git 索引,事件循环只遍历结果列表"""
+    indexed = iter_git_index_files(root_dir, file_filter)
+    return None if indexed is None else list(indexed)
+
+async def _aiter_input_files(path_args: List[str], executor: ThreadPoolExecutor,
+                             listing_cache: Optional[PersistentCache] = None,
+                             backend: str = DISCOVERY_BACKEND,
+                             respect_gitignore: bool = RESPECT_GITIGNORE,
+                             file_filter: FileFilter = _DEFAULT_FILTER) -> AsyncIterator[DiscoveredFile]:
+    """iter_input_files 的异步版本:stat、git 索引解析与目录列出都在 executor 中执行"""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    processed_paths = set()
+    for path_arg in path_args:
+        abs_path = os.path.abspath(path_arg)
+        if abs_path in processed_paths:
+            continue
+        
+        try:
+            path_stat = await loop.run_in_executor(executor, os.stat, abs_path)
+        except OSError:
+            continue
+        
+        if stat.S_ISDIR(path_stat.st_mode):
+            indexed = None
+            if backend == 'git':
+                indexed = await loop.run_in_executor(executor, _list_git_index_files, abs_path, file_filter)
+            if indexed is not None:
+                for discovered in indexed:
+                    if discovered.path not in processed_paths:
+                        processed_paths.add(discovered.path)
+                        yield discovered
+                continue
+            async for discovered in _aiter_directory_files(abs_path, executor, listing_cache,
+                                                           respect_gitignore, file_filter):
+                if discovered.path not in processed_paths:
+                    processed_paths.add(discovered.path)
+                    yield discovered
+        elif stat.S_ISREG(path_stat.st_mode):
+            processed_paths.add(abs_path)
+            yield DiscoveredFile(abs_path, False, path_stat)
+
+async def merge_async(paths: List[str], options: Optional[MergeOptions] = None,
+                      on_result: Optional[Callable[[ProcessResult], None]] = None) -> AsyncIterator[str]:
+    """异步合并:列出目录、分析文件、组装与格式化输出都拆成小步骤提交到共用的有界线程池,
+    由事件循环调度,不为每次合并另建线程池或遍历线程,同一事件循环中的多个合并共享 ASYNC_MAX_WORKERS 个线程。
+    on_result 在每个文件分析完成时于事件循环线程中调用(按完成顺序);
+    输出开头的统计头依赖全部结果,文本段在分析结束后按批格式化,每批就绪即产出。
+    文件始终在线程池中分析,executor_backend 只对 merge() 生效。
+    用法: async for chunk in merge_async(paths, options): ..."""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    executor = _get_async_executor()
+    options = options or MergeOptions()
+    file_filter = options.file_filter()
+    start_time = time.monotonic()
+    collector = ResultCollector(MergeSummary())
+    timer = PhaseTimer(collector.summary.phases)
+    spill_store = open_spill_store(options)
+    retainer = ContentRetainer(options.content_retain_limit_bytes, spill_store)
+    cache = None
+    chunks = None
+    pending = None
+    in_flight: Dict = {}  # asyncio Future -> (线程池中的 Future, 计入的在途字节数)
+    in_flight_bytes = 0
+    
+    async def collect_completed() -> None:
+        nonlocal in_flight_bytes
+        done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            in_flight_bytes -= in_flight.pop(future)[1]
+            res = future.result()
+            if res.status == Status.MISSING:
+                continue
+            if on_result is not None:
+                on_result(res)
+            collector.add(res)
+    
+    try:
+        cache = await loop.run_in_executor(executor, open_cache, options)
+        content_cache = cache if options.content_cache else None
+        with timer.phase('analyze'):
+            async for item in _aiter_input_files(paths, executor, cache if options.directory_cache else None,
+                                                 options.discovery_backend, options.respect_gitignore, file_filter):
+                cost = _estimated_read_bytes(item, file_filter)
+                # 与 iter_analyzed_files 相同的限流:在途数量或字节数超限时先收取已完成的结果
+                while in_flight and (len(in_flight) >= MAX_IN_FLIGHT_FILES
+                                     or in_flight_bytes + cost > MAX_IN_FLIGHT_BYTES):
+                    await collect_completed()
+                future = executor.submit(_instrumented(_analyze_and_admit, 'analyze_file'), retainer,
+                                         item.path, item.parent_cleared,
+                                         item.stat_result, spill_store if options.spill_to_disk else None,
+                                         content_cache, item.stat_verified, file_filter)
+                in_flight[asyncio.wrap_future(future, loop=loop)] = (future, cost)
+                in_flight_bytes += cost
+            while in_flight:
+                await collect_completed()
+        collector.finish(start_time)
+        
+        with timer.phase('assemble'):
+            prepared = await loop.run_in_executor(executor, prepare_output, collector.results, timer)
+        if prepared is None:
+            return
+        stats_header, sorted_results, collector.summary.base_path = prepared
+        # 每个步骤在当前工作线程中依次加载内容,不在共用线程池中等待其它任务
+        chunks = iter_output_chunks(stats_header, sorted_results, spill_store, window=0)
+        with timer.phase('output'):
+            while True:
+                pending = executor.submit(_next_chunk_batch, chunks, ASYNC_CHUNK_CHARS)
+                batch = await asyncio.wrap_future(pending, loop=loop)
+                pending = None
+                if batch is _CHUNKS_DONE:
+                    break
+                yield batch
+    finally:
+        # 正常结束、调用方提前停止或任务被取消时都在这里释放资源:
+        # 取消尚未开始的分析步骤,在线程池中等待已开始的步骤结束后关闭生成器、段文件与缓存
+        started = [future for future, _ in in_flight.values() if not future.cancel()]
+        if pending is not None:
+            started.append(pending)
+        await asyncio.shield(loop.run_in_executor(executor, _release_async_merge, started, chunks,
+                                                  spill_store, cache))
+
+# --- 监视模式 ---
+
+# 只由路径决定的状态:路径不变则结果不变,无需 stat 检查
+_PATH_ONLY_STATUSES = {
+    Status.SKIPPED_EXCLUDED_PATH,
+    Status.SKIPPED_EXCLUDED_PATTERN,
+    Status.SKIPPED_NOT_WHITELISTED,
+}
+
+class MemoryListingCache:
+    """监视模式使用的内存目录列表缓存,接口与 PersistentCache 的目录列表部分一致"""
+
+    def __init__(self):
+        self._listings: Dict[str, tuple] = {}
+
+    def get_listing(self, dir_path: str, mtime_ns: int, filter_key: str):
+        entry = self._listings.get(dir_path)
+        if entry is None or entry[0] != (mtime_ns, filter_key):
+            return None
+        return entry[1], entry[2]
+
+    def put_listing(self, dir_path: str, mtime_ns: int, filter_key: str,
+                    file_entries: List[tuple], dirs: List[tuple]) -> None:
+        if time.time() - mtime_ns / 1e9 < CACHE_RACY_WINDOW_SECONDS:
+            return
+        self._listings[dir_path] = ((mtime_ns, filter_key), file_entries, dirs)
+
+def _stat_signature(stat_result: Optional[os.stat_result]):
+    """用于判断文件是否变化的 stat 特征"""
+    if stat_result is None:
+        return None
+    return stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino
+
+def _stat_paths(paths: List[str]) -> List[Optional[os.stat_result]]:
+    """依次 stat 一批文件,失败的位置为 None"""
+    results = []
+    for path in paths:
+        try:
+            results.append(os.stat(path))
+        except OSError:
+            results.append(None)
+    return results
+
+class WatchSession:
+    """监视模式的常驻状态:保存每个文件的分析结果,只重新分析变化的文件,并就地更新目录树与统计。
+    options 中的过滤、.gitignore 与执行方式设置与单次运行一致(发现方式除外,见 refresh)"""
+
+    def __init__(self, path_args: List[str], options: Optional[MergeOptions] = None,
+                 content_cache: Optional[PersistentCache] = None, output_files: Tuple[str, ...] = ()):
+        self.path_args = path_args
+        # 输出文件(及其临时文件)位于被监视的目录中时不作为输入,否则每次写出都会触发下一次重写
+        self.ignored_paths = {path for output_file in output_files for path in (output_file, output_file + '.tmp')}
+        self.options = options or MergeOptions()
+        self.file_filter = self.options.file_filter()
+        self.content_cache = content_cache
+        self.listing_cache = MemoryListingCache()
+        # 进程池传回的内容与溢写模式下的内容保存在段文件中,随会话关闭删除
+        self.spill_store = open_spill_store(self.options)
+        self.results: Dict[str, ProcessResult] = {}
+        self.signatures: Dict[str, tuple] = {}
+        self.base_path: Optional[str] = None
+        self.tree_dict: dict = {}
+        self.tree_count = 0
+        self.extension_count: Dict[str, int] = defaultdict(int)
+        # 与 sort_files_by_priority 相同的顺序:代码文件在前,文档在后,各自按路径排序
+        self.code_paths: List[str] = []
+        self.doc_paths: List[str] = []
+        # 目录列表来自缓存的文件没有 stat 信息,每次检查都要重新 stat,在线程池中分批进行
+        self._stat_executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def text_count(self) -> int:
+        return len(self.code_paths) + len(self.doc_paths)
+
+    def close(self) -> None:
+        """停止 stat 线程池并删除段文件"""
+        if self._stat_executor is not None:
+            self._stat_executor.shutdown(wait=False)
+            self._stat_executor = None
+        self.spill_store.close()
+
+    def _stat_missing(self, items: List[DiscoveredFile]) -> Dict[str, Optional[os.stat_result]]:
+        """并发 stat 没有 stat 信息的文件,返回 路径 -> stat 结果(失败为 None)"""
+        paths = [item.path for item in items]
+        if not paths:
+            return {}
+        if self._stat_executor is None:
+            self._stat_executor = ThreadPoolExecutor(DISCOVERY_WORKERS, thread_name_prefix='mNc-watch-stat')
+        batches = [paths[i:i + WATCH_STAT_BATCH] for i in range(0, len(paths), WATCH_STAT_BATCH)]
+        stats = {}
+        for batch, results in zip(batches, self._stat_executor.map(_stat_paths, batches)):
+            stats.update(zip(batch, results))
+        return stats
+
+    def refresh(self) -> List[str]:
+        """检查变化并重新分析变化的文件,返回新增、修改或删除的路径列表"""
+        # 变化检测依赖真实的 stat 信息,因此始终遍历文件系统而不使用 git 索引
+        discovered = {item.path: item for item in iter_input_files(self.path_args, self.listing_cache, 'walk',
+                                                                   self.options.respect_gitignore,
+                                                                   self.file_filter)
+                      if item.path not in self.ignored_paths}
+        
+        removed = [path for path in self.results if path not in discovered]
+        tree_changed = False
+        for path in removed:
+            tree_changed |= self._remove(path)
+            self.signatures.pop(path, None)
+        
+        candidates = [item for path, item in discovered.items()
+                      if not (path in self.results and self.results[path].status in _PATH_ONLY_STATUSES)]
+        missing_stats = self._stat_missing([item for item in candidates if item.stat_result is None])
+        
+        to_analyze: List[DiscoveredFile] = []
+        for item in candidates:
+            path = item.path
+            old = self.results.get(path)
+            stat_result = item.stat_result if item.stat_result is not None else missing_stats[path]
+            signature = _stat_signature(stat_result)
+            if old is not None and self.signatures.get(path) == signature:
+                continue
+            self.signatures[path] = signature
+            to_analyze.append(DiscoveredFile(path, item.parent_cleared, stat_result))
+        
+        added_to_tree = []
+        options = self.options
+        for res in iter_analyzed_files(iter(to_analyze), options.max_workers, self.spill_store, self.content_cache,
+                                       options.executor_backend, options.spill_to_disk, self.file_filter):
+            existed = res.path in self.results
+            if existed:
+                self._remove(res.path)
+            if self._add(res):
+                added_to_tree.append(res.path)
+                tree_changed |= not existed
+        
+        # 目录树中的路径集合变化(新增或删除)时重新确定基础路径:
+        # 基础路径不变时只插入新路径,否则重建整棵树;只有文件内容变化时树不变
+        if tree_changed or (added_to_tree and self.base_path is None):
+            tree_paths = self._tree_paths()
+            base_path = compute_base_path(tree_paths) if tree_paths else None
+            if base_path is not None and base_path == self.base_path:
+                for path in added_to_tree:
+                    tree_insert(self.tree_dict, path, self.base_path)
+            else:
+                self._rebuild_tree(tree_paths, base_path)
+        else:
+            for path in added_to_tree:
+                tree_insert(self.tree_dict, path, self.base_path)
+        
+        return removed + [item.path for item in to_analyze]
+
+    def _sorted_list(self, path: str) -> List[str]:
+        return self.doc_paths if is_documentation_file(path) else self.code_paths
+
+    def _add(self, res: ProcessResult) -> bool:
+        """记录一个结果,返回它是否需要出现在目录树中"""
+        self.results[res.path] = res
+        if res.status == Status.TEXT_SUCCESS:
+            self.extension_count[extension_key(res.path)] += 1
+            bisect.insort(self._sorted_list(res.path), res.path)
+        if res.status == Status.SKIPPED_EXCLUDED_PATH:
+            return False
+        self.tree_count += 1
+        return True
+
+    def _remove(self, path: str) -> bool:
+        """移除一个结果,返回它是否在目录树中"""
+        res = self.results.pop(path)
+        if res.status == Status.TEXT_SUCCESS:
+            key = extension_key(path)
+            self.extension_count[key] -= 1
+            if not self.extension_count[key]:
+                del self.extension_count[key]
+            paths = self._sorted_list(path)
+            index = bisect.bisect_left(paths, path)
+            if index < len(paths) and paths[index] == path:
+                del paths[index]
+        if res.status == Status.SKIPPED_EXCLUDED_PATH:
+            return False
+        self.tree_count -= 1
+        if self.base_path is not None:
+            tree_remove(self.tree_dict, path, self.base_path)
+        return True
+
+    def _tree_paths(self) -> List[str]:
+        return [path for path, res in self.results.items() if res.status != Status.SKIPPED_EXCLUDED_PATH]
+
+    def _rebuild_tree(self, tree_paths: List[str], base_path: Optional[str]) -> None:
+        self.tree_dict = {}
+        self.base_path = base_path
+        for path in tree_paths:
+            tree_insert(self.tree_dict, path, self.base_path)
+
+    def sorted_text_results(self) -> List[ProcessResult]:
+        return [self.results[path] for path in self.code_paths + self.doc_paths]
+
+    def build_header(self) -> str:
+        tree_structure = render_tree(self.tree_dict, self.base_path) if self.base_path is not None else ""
+        return build_stats_header(self.base_path or "", len(self.code_paths) + len(self.doc_paths),
+                                  self.tree_count, sort_extension_stats(self.extension_count), tree_structure)
+
+    def write_output(self, output_file: str, use_clipboard: bool = True) -> int:
+        """重写输出文件(先写临时文件再替换,读取方不会看到写了一半的内容),返回字符数"""
+        chunks = iter_output_chunks(self.build_header(), self.sorted_text_results(), self.spill_store)
+        text = "".join(chunks)
+        temp_file = output_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temp_file, output_file)
+        if use_clipboard and PYPERCLIP_AVAILABLE:
+            try:
+                pyperclip.copy(text)
+            except Exception:
+                pass
+        return len(text)
+
+def run_watch(path_args: List[str], options: Optional[MergeOptions] = None,
+              content_cache: Optional[PersistentCache] = None, output_file: Optional[str] = None,
+              use_clipboard: bool = True):
+    """监视模式:首次完整生成后持续检查变化,只重新分析变化的文件并重写同一个输出文件
+    (output_file 默认为桌面上以启动时间命名的文件)"""
+    output_file = output_file or timestamped_output_file()
+    
+    print("--- 监视模式: 正在首次生成... ---")
+    session = WatchSession(path_args, options, content_cache, (output_file,))
+    try:
+        session.refresh()
+        # 没有可合并的文本文件时不写出(也不覆盖剪贴板),出现文本文件后再生成
+        if session.text_count:
+            total_chars = session.write_output(output_file, use_clipboard)
+            print(f"✅ 已生成文件: {output_file}")
+            print(f"   文本文件 {session.text_count} 个, 共 {total_chars:,} 字符")
+        else:
+            print("ℹ️ 未处理任何有效文本内容,出现文本文件后再生成输出。")
+        print(f"👀 正在监视变化 (每 {WATCH_INTERVAL_SECONDS} 秒检查一次), 按 Ctrl+C 退出")
+        
+        while True:
+            time.sleep(WATCH_INTERVAL_SECONDS)
+            start_time = time.monotonic()
+            changed = session.refresh()
+            if not changed:
+                continue
+            if session.text_count:
+                total_chars = session.write_output(output_file, use_clipboard)
+                elapsed_ms = (time.monotonic() - start_time) * 1000
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] {len(changed)} 个文件变化, "
+                      f"已更新输出 ({total_chars:,} 字符, {elapsed_ms:.0f} ms)")
+            else:
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] {len(changed)} 个文件变化, "
+                      f"没有可合并的文本文件,未更新输出")
+            for path in changed[:5]:
+                print(f"  - {truncate_path(path, MAX_PATH_DISPLAY_LEN)}")
+    except KeyboardInterrupt:
+        print("\n已退出监视模式。")
+    finally:
+        session.close()
+
+# --- 常驻进程 ---
+
+def _daemon_address() -> Tuple[str, str]:
+    """常驻进程的监听地址:Windows 使用命名管道,其它平台使用用户缓存目录下的 Unix 套接字"""
+    if sys.platform == 'win32':
+        user = re.sub(r'[^\w.-]', '_', os.environ.get('USERNAME', 'user'))
+        return rf'\\.\pipe\mNc-daemon-{user}', 'AF_PIPE'
+    return os.path.join(get_cache_dir(), 'daemon.sock'), 'AF_UNIX'
+
+def _daemon_key_path() -> str:
+    """常驻进程的认证密钥文件,只有当前用户可读"""
+    return os.path.join(get_cache_dir(), 'daemon.key')
+
+def _connect_daemon() -> Optional[object]:
+    """连接常驻进程,没有可用的常驻进程时返回 None"""
+    from multiprocessing.connection import Client, AuthenticationError
+    try:
+        with open(_daemon_key_path(), 'rb') as f:
+            authkey = f.read()
+    except OSError:
+        return None
+    address, family = _daemon_address()
+    try:
+        return Client(address, family, authkey=authkey)
+    except (OSError, EOFError, AuthenticationError):
+        return None
+
+class DaemonServer:
+    """常驻进程:按输入路径保留 WatchSession,重复请求只需检查变化并重写输出。
+    所有请求都使用启动常驻进程时的选项与输出位置(output_file 为固定文件,否则为 output_dir 下按时间命名的文件)"""
+
+    def __init__(self, options: Optional[MergeOptions] = None, content_cache: Optional[PersistentCache] = None,
+                 output_file: Optional[str] = None, output_dir: Optional[str] = None):
+        self.options = options or MergeOptions()
+        self.content_cache = content_cache
+        self.output_file = output_file
+        self.output_dir = output_dir
+        self._sessions: "OrderedDict[tuple, Tuple[WatchSession, threading.Lock]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_session(self, paths: List[str]) -> Tuple[WatchSession, threading.Lock]:
+        key = tuple(paths)
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None:
+                output_files = (self.output_file,) if self.output_file else ()
+                entry = (WatchSession(paths, self.options, self.content_cache, output_files), threading.Lock())
+                self._sessions[key] = entry
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > DAEMON_MAX_SESSIONS:
+                _, (evicted, _) = self._sessions.popitem(last=False)
+                evicted.close()
+        return entry
+
+    def handle_merge(self, paths: List[str]) -> dict:
+        """处理一次合并请求,返回给客户端的结果"""
+        start_time = time.monotonic()
+        session, session_lock = self._get_session(paths)
+        with session_lock:
+            changed = session.refresh()
+            output_file = self.output_file or timestamped_output_file(self.output_dir)
+            total_chars = session.write_output(output_file)
+            text_count = session.text_count
+            failed = [(path, res.error_message) for path, res in session.results.items() if res.status == Status.FAILED]
+        return {
+            'output_file': output_file,
+            'total_chars': total_chars,
+            'text_files': text_count,
+            'changed_files': len(changed),
+            'failed': failed,
+            'elapsed': time.monotonic() - start_time,
+        }
+
+    def _serve_connection(self, conn, request: dict) -> None:
+        with conn:
+            try:
+                reply = self.handle_merge(request['paths'])
+            except Exception as e:
+                reply = {'error': str(e)}
+            try:
+                conn.send(reply)
+            except OSError:
+                return
+        if 'error' in reply:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] ❌ 请求失败: {reply['error']}")
+        else:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] {reply['text_files']} 个文本文件, "
+                  f"{reply['changed_files']} 个变化, {reply['elapsed'] * 1000:.0f} ms -> {reply['output_file']}")
+
+    def serve_forever(self) -> None:
+        import secrets
+        from multiprocessing.connection import Listener, AuthenticationError
+        address, family = _daemon_address()
+        os.makedirs(get_cache_dir(), mode=0o700, exist_ok=True)
+        if family == 'AF_UNIX' and os.path.exists(address):
+            # 上次异常退出残留的套接字文件
+            os.remove(address)
+        
+        authkey = secrets.token_bytes(32)
+        key_path = _daemon_key_path()
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(authkey)
+        
+        with Listener(address, family, authkey=authkey) as listener:
+            if family == 'AF_UNIX':
+                os.chmod(address, 0o600)
+            print(f"--- mNc 常驻进程已启动: {address} ---")
+            print("按 Ctrl+C 或运行 python mNc.py --daemon-stop 退出")
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, AuthenticationError):
+                    continue
+                # 请求在连接建立后立即发送,避免异常客户端阻塞主循环
+                try:
+                    request = conn.recv() if conn.poll(5) else None
+                except (OSError, EOFError):
+                    request = None
+                if not isinstance(request, dict):
+                    conn.close()
+                    continue
+                if request.get('command') == 'shutdown':
+                    conn.send({'ok': True})
+                    conn.close()
+                    print("--- 收到退出请求,常驻进程已停止 ---")
+                    return
+                threading.Thread(target=self._serve_connection, args=(conn, request),
+                                 name="mNc-daemon-request", daemon=True).start()
+
+def run_daemon(options: Optional[MergeOptions] = None, content_cache: Optional[PersistentCache] = None,
+               output_file: Optional[str] = None, output_dir: Optional[str] = None) -> None:
+    """启动常驻进程"""
+    try:
+        DaemonServer(options, content_cache, output_file, output_dir).serve_forever()
+    except KeyboardInterrupt:
+        print("\n常驻进程已停止。")
+
+def stop_daemon() -> bool:
+    """请求正在运行的常驻进程退出,返回是否成功"""
+    conn = _connect_daemon()
+    if conn is None:
+        return False
+    with conn:
+        conn.send({'command': 'shutdown'})
+        try:
+            return bool(conn.recv().get('ok'))
+        except (OSError, EOFError):
+            return False
+
+def run_client(path_args: List[str]) -> Optional[dict]:
+    """把请求交给常驻进程处理并打印结果,返回常驻进程的回复;
+    没有可用的常驻进程时返回 None,由调用方在本进程处理"""
+    conn = _connect_daemon()
+    if conn is None:
+        return None
+    with conn:
+        try:
+            conn.send({'command': 'merge', 'paths': [os.path.abspath(p) for p in path_args]})
+            reply = conn.recv()
+        except (OSError, EOFError):
+            return None
+    
+    if 'error' in reply:
+        print(f"❌ 常驻进程处理失败: {reply['error']}")
+        return None
+    print(f"✅ 已生成文件: {reply['output_file']}")
+    print(f"   文本文件 {reply['text_files']} 个, 共 {reply['total_chars']:,} 字符 "
+          f"(常驻进程, {reply['elapsed'] * 1000:.0f} ms)")
+    failed = reply.get('failed', [])
+    if failed:
+        print("\n失败的路径列表:")
+        for path, reason in failed:
+            print(f"  - {path}\n    原因: {reason}")
+    return reply
+
+# --- 主程序 ---
+
+# 退出码(argparse 参数错误时为 2)
+EXIT_OK = 0
+EXIT_OUTPUT_ERROR = 1      # 输出文件无法写出
+EXIT_USAGE = 2             # 没有指定输入
+EXIT_FILES_FAILED = 3      # 已生成输出,但有文件读取失败
+EXIT_NOTHING_MERGED = 4    # 没有找到任何可合并的文本文件
+
+def pause_before_exit(has_failures: bool) -> None:
+    """交互式运行结束前停留片刻,让拖拽启动的控制台窗口来得及显示结果;有失败文件时停留更久"""
+    timeout = 30 if has_failures else 5
+    print(f"\n程序将在 {timeout} 秒后自动关闭...")
+    time.sleep(timeout)
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(prog='mNc', description='将文件/文件夹合并为单个文本文件,方便发送给 AI 助手。')
+    parser.add_argument('paths', nargs='*', help='要处理的文件或文件夹')
+    parser.add_argument('--watch', action='store_true',
+                        help='监视模式: 文件变化时只重新分析变化的文件并重写输出(使用本次运行的过滤与输出选项)')
+    parser.add_argument('--daemon', action='store_true',
+                        help='启动常驻进程;之后以 --use-daemon 运行(或 DAEMON_AUTO_CONNECT 为 True 时的交互式运行)'
+                             '会交给它处理以便立即返回,所有请求都使用启动时的过滤与输出选项')
+    parser.add_argument('--daemon-stop', action='store_true', help='停止正在运行的常驻进程')
+    parser.add_argument('--use-daemon', action='store_true',
+                        help='把本次运行交给 --daemon 启动的常驻进程处理;没有可用的常驻进程,'
+                             '或指定了过滤、输出与诊断选项时在本进程处理')
+    parser.add_argument('--no-daemon', action='store_true',
+                        help='不连接常驻进程,始终在本进程处理(覆盖 --use-daemon 与 DAEMON_AUTO_CONNECT)')
+    parser.add_argument('--git-index', action='store_true',
+                        help='对 git 仓库从 .git/index 列出已跟踪的文件,不遍历文件系统')
+    
+    batch = parser.add_argument_group('批处理 / 输出')
+    batch.add_argument('--batch', action='store_true',
+                       help='非交互模式: 结束时不等待,按结果返回退出码')
+    batch.add_argument('-v', '--verbose', action='store_true',
+                       help='逐个打印每个文件的处理结果(默认只显示进度与失败的文件)')
+    batch.add_argument('--output', metavar='FILE', help='输出文件路径(默认写到桌面,以时间命名)')
+    batch.add_argument('--output-dir', metavar='DIR', help='输出目录,文件名仍以时间命名')
+    batch.add_argument('--no-clipboard', action='store_true', help='不复制到剪贴板')
+    batch.add_argument('--metrics-file', metavar='FILE',
+                       help='运行结束后以 Prometheus 文本格式原子写出指标(用于 node_exporter textfile collector,'
+                            '文件名需以 .prom 结尾)')
+    batch.add_argument('--report-json', metavar='FILE',
+                       help='写出 JSON 运行报告; "-" 表示输出到标准输出(此时其它信息输出到标准错误)')
+    
+    diagnostics = parser.add_argument_group('性能分析')
+    diagnostics.add_argument('--profile', action='store_true',
+                             help='报告各阶段耗时与耗时最多的函数(cProfile,包含工作线程)')
+    diagnostics.add_argument('--profile-out', metavar='FILE',
+                             help='同时把 cProfile 结果写出为 .prof 文件(隐含 --profile)')
+    diagnostics.add_argument('--trace', metavar='FILE',
+                             help='写出 Chrome trace JSON(Perfetto / chrome://tracing),'
+                                  '包含各工作线程的逐文件区间与各阶段区间;进程池中的文件不单独记录')
+    diagnostics.add_argument('--memprofile', action='store_true',
+                             help='在各阶段结束时记录 tracemalloc 快照与 RSS,报告分配最多的位置'
+                                  '与峰值相对输入字节数的倍数(显著变慢)')
+    
+    config = parser.add_argument_group('配置(默认值取自脚本开头的常量)')
+    config.add_argument('--no-gitignore', action='store_true', help='不遵守 .gitignore 等忽略文件')
+    config.add_argument('--executor', choices=['auto', 'thread', 'process'], default=EXECUTOR_BACKEND,
+                        help=f'解码执行方式(默认 {EXECUTOR_BACKEND})')
+    config.add_argument('--workers', type=int, metavar='N', help='分析线程数')
+    config.add_argument('--spill', action='store_true', default=SPILL_TO_DISK, help='解码后的内容写入临时段文件')
+    config.add_argument('--spill-dir', metavar='DIR', default=SPILL_DIRECTORY, help='临时段文件所在目录')
+    config.add_argument('--cache', action='store_true',
+                        help='开启持久化内容缓存与目录列表缓存(缓存目录中会保留一份合并过的文件内容)')
+    config.add_argument('--no-cache', action='store_true', help='不使用持久化内容缓存')
+    config.add_argument('--no-dir-cache', action='store_true', help='不使用目录列表缓存')
+    config.add_argument('--cache-dir', metavar='DIR', default=CACHE_DIRECTORY, help='持久化缓存目录')
+    config.add_argument('--retain-limit-mb', type=int, metavar='MB',
+                        default=CONTENT_RETAIN_LIMIT_BYTES // (1024 * 1024),
+                        help='分析阶段内存中保留的文件内容上限(MB),超出部分暂存到临时段文件')
+    
+    filters = parser.add_argument_group('过滤(默认值取自脚本开头的常量)')
+    filters.add_argument('--max-size-mb', type=float, metavar='MB',
+                         default=MAX_FILE_SIZE_BYTES / (1024 * 1024),
+                         help=f'单个文件的大小上限(MB,默认 {MAX_FILE_SIZE_BYTES / (1024 * 1024):g}),超过的文件跳过')
+    filters.add_argument('--extensions', metavar='LIST',
+                         help='以逗号分隔的白名单,替换 FORCE_TEXT_EXTENSIONS,如 ".py,.md,Dockerfile";"*" 表示无后缀的文件')
+    filters.add_argument('--add-extensions', metavar='LIST', help='以逗号分隔,追加到白名单')
+    filters.add_argument('--exclude-path', action='append', default=[], metavar='PATH',
+                         help='追加排除路径(同 EXCLUDED_PATHS,支持多级路径与通配符),可重复')
+    filters.add_argument('--exclude-pattern', action='append', default=[], metavar='GLOB',
+                         help='追加排除文件模式(同 EXCLUDED_FILE_PATTERNS),可重复')
+    filters.add_argument('--no-default-excludes', action='store_true',
+                         help='不使用内置的 EXCLUDED_PATHS 与 EXCLUDED_FILE_PATTERNS,只使用命令行中给出的排除规则')
+    return parser.parse_args(argv)
+
+def _split_extensions(value: Optional[str]) -> List[str]:
+    """解析逗号分隔的后缀列表;以 . 开头的后缀统一为小写(与白名单检查一致)"""
+    if not value:
+        return []
+    items = [item.strip() for item in value.split(',') if item.strip()]
+    return [item.lower() if item.startswith('.') else item for item in items]
+
+def options_from_args(args: argparse.Namespace) -> MergeOptions:
+    """由命令行参数构造合并选项"""
+    return MergeOptions(
+        discovery_backend='git' if args.git_index else DISCOVERY_BACKEND,
+        respect_gitignore=RESPECT_GITIGNORE and not args.no_gitignore,
+        executor_backend=args.executor,
+        max_workers=args.workers,
+        spill_to_disk=args.spill,
+        spill_directory=args.spill_dir,
+        content_cache=(CONTENT_CACHE_ENABLED or args.cache) and not args.no_cache,
+        directory_cache=(DIRECTORY_CACHE_ENABLED or args.cache) and not args.no_dir_cache,
+        cache_directory=args.cache_dir,
+        content_retain_limit_bytes=args.retain_limit_mb * 1024 * 1024,
+        allowed_extensions=frozenset(_split_extensions(args.extensions) if args.extensions is not None
+                                     else FORCE_TEXT_EXTENSIONS) | frozenset(_split_extensions(args.add_extensions)),
+        excluded_paths=tuple(([] if args.no_default_excludes else EXCLUDED_PATHS) + args.exclude_path),
+        excluded_file_patterns=tuple(([] if args.no_default_excludes else EXCLUDED_FILE_PATTERNS)
+                                     + args.exclude_pattern),
+        max_file_size_bytes=int(args.max_size_mb * 1024 * 1024),
+    )
+
+def main() -> int:
+    args = parse_args(sys.argv[1:])
+    if args.daemon_stop:
+        print("✅ 常驻进程已停止" if stop_daemon() else "ℹ️ 没有正在运行的常驻进程")
+        return EXIT_OK
+    
+    if not args.daemon and not args.paths:
+        print("用法: 请将一个或多个文件/文件夹拖拽到 .bat 文件上。")
+        if not args.batch:
+            time.sleep(3)
+        return EXIT_USAGE
+
+    options = options_from_args(args)
+    # 常驻进程使用启动时的选项与输出位置,只接手没有指定这些选项的运行,不可用时回退到本进程
+    daemon_compatible = not (args.verbose or args.output or args.output_dir or args.no_clipboard
+                             or args.report_json or args.profile or args.profile_out or args.trace
+                             or args.memprofile or args.metrics_file) \
+        and options == MergeOptions()
+    wants_daemon = args.use_daemon or (DAEMON_AUTO_CONNECT and not args.batch)
+    if wants_daemon and not (args.daemon or args.watch or args.no_daemon):
+        reply = run_client(args.paths) if daemon_compatible else None
+        if reply is not None:
+            failed = bool(reply.get('failed'))
+            if not args.batch:
+                pause_before_exit(failed)
+            return EXIT_FILES_FAILED if failed else EXIT_OK
+        if args.use_daemon:
+            print("ℹ️ 常驻进程只使用启动时的选项,本次指定了过滤、输出或诊断选项,改在本进程处理"
+                  if not daemon_compatible else "ℹ️ 常驻进程不可用,改在本进程处理")
+
+    if not (args.daemon or args.watch):
+        if args.report_json == '-':
+            # 标准输出只留给 JSON 报告
+            with redirect_stdout(sys.stderr):
+                report = merge_and_report(args.paths, options, args)
+            json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+            print()
+        else:
+            report = merge_and_report(args.paths, options, args)
+            if args.report_json:
+                try:
+                    with open(args.report_json, 'w', encoding='utf-8') as f:
+                        json.dump(report, f, ensure_ascii=False, indent=2)
+                except OSError as e:
+                    print(f"⚠️  JSON 报告写出失败: {e}")
+        return report['exit_code']
+    
+    cache = open_cache(options)
+    try:
+        content_cache = cache if options.content_cache else None
+        if args.daemon:
+            run_daemon(options, content_cache, os.path.abspath(args.output) if args.output else None,
+                       args.output_dir)
+        else:
+            run_watch(args.paths, options, content_cache, resolve_output_file(args), not args.no_clipboard)
+    finally:
+        if cache is not None:
+            cache.close()
+    return EXIT_OK
+
+def resolve_output_file(args: Optional[argparse.Namespace]) -> str:
+    """输出文件路径:--output 指定的文件,否则为 --output-dir(默认桌面)下以时间命名的文件"""
+    if args is not None and args.output:
+        return os.path.abspath(args.output)
+    return timestamped_output_file(args.output_dir if args is not None else None)
+
+def timestamped_output_file(output_dir: Optional[str] = None) -> str:
+    """output_dir(默认桌面)下以当前时间命名的输出文件"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return os.path.join(output_dir or get_desktop_path(), f"{timestamp}.txt")
+
+def _file_timing_record(res: ProcessResult) -> dict:
+    """单个文件的耗时记录(JSON 报告用)"""
+    return {
+        'path': res.path,
+        'status': res.status.name,
+        'size': res.size,
+        'bytes_read': res.bytes_read,
+        'decoded_chars': res.decoded_chars,
+        'encoding': res.encoding,
+        'stat_seconds': round(res.stat_seconds, 6),
+        'read_seconds': round(res.read_seconds, 6),
+        'decode_seconds': round(res.decode_seconds, 6),
+    }
+
+def _table_row(cells: List[str], widths: List[int]) -> str:
+    """按显示宽度对齐一行:正宽度右对齐,负宽度左对齐"""
+    parts = []
+    for cell, width in zip(cells, widths):
+        pad = ' ' * max(abs(width) - _display_width(cell), 0)
+        parts.append(pad + cell if width > 0 else cell + pad)
+    return '  ' + ''.join(parts).rstrip()
+
+def print_file_timing_report(summary: MergeSummary) -> None:
+    """打印最慢、最大的文件与按扩展名的合计,用于调整 EXCLUDED_PATHS 与 MAX_FILE_SIZE_BYTES"""
+    if summary.slowest_files:
+        widths = [12, 10, 10, 10, 14, 2, -12, -1]
+        print(f"\n----- 分析最慢的 {len(summary.slowest_files)} 个文件(毫秒) -----")
+        print(_table_row(['合计', 'stat', '读取', '解码', '读取字节', '', '编码', '路径'], widths))
+        for res in summary.slowest_files:
+            print(_table_row([f"{res.elapsed_seconds * 1000:.2f}", f"{res.stat_seconds * 1000:.2f}",
+                              f"{res.read_seconds * 1000:.2f}", f"{res.decode_seconds * 1000:.2f}",
+                              f"{res.bytes_read:,}", '', res.encoding or '-',
+                              truncate_path(res.path, MAX_PATH_DISPLAY_LEN)], widths))
+    
+    if summary.largest_files:
+        widths = [14, 2, -24, -1]
+        print(f"\n----- 最大的 {len(summary.largest_files)} 个文件 -----")
+        print(_table_row(['字节', '', '状态', '路径'], widths))
+        for res in summary.largest_files:
+            print(_table_row([f"{res.size:,}", '', res.status.name,
+                              truncate_path(res.path, MAX_PATH_DISPLAY_LEN)], widths))
+    
+    if summary.extension_totals:
+        widths = [-14, 10, 16, 16, 12]
+        print("\n----- 按扩展名合计(按耗时降序) -----")
+        print(_table_row(['扩展名', '文件数', '读取字节', '字符数', '耗时(秒)'], widths))
+        for ext, totals in summary.extension_totals.items():
+            print(_table_row([ext, f"{totals.files:,}", f"{totals.bytes_read:,}",
+                              f"{totals.decoded_chars:,}", f"{totals.seconds:.3f}"], widths))
+
+def _metric_label(value: str) -> str:
+    """转义 Prometheus 标签值"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _metric_number(value: float) -> str:
+    """Prometheus 文本格式的数值:整数不带小数点"""
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _histogram_lines(name: str, help_text: str, histogram: Histogram) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for bound, total in zip(histogram.buckets, histogram.cumulative()):
+        lines.append(f'{name}_bucket{{le="{_metric_number(bound)}"}} {total}')
+    lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.count}')
+    lines.append(f"{name}_sum {_metric_number(histogram.sum)}")
+    lines.append(f"{name}_count {histogram.count}")
+    return lines
+
+def format_metrics(summary: MergeSummary, exit_code: int, bytes_written: int) -> str:
+    """以 Prometheus 文本格式描述一次运行(供 node_exporter 的 textfile collector 采集)"""
+    lines = ["# HELP mnc_files_total Files processed in the last run, by status.",
+             "# TYPE mnc_files_total counter"]
+    for status in Status:
+        lines.append(f'mnc_files_total{{status="{status.name.lower()}"}} {summary.count(status)}')
+    lines += ["# HELP mnc_read_bytes_total Source bytes read from disk in the last run.",
+              "# TYPE mnc_read_bytes_total counter",
+              f"mnc_read_bytes_total {summary.bytes_read}",
+              "# HELP mnc_written_bytes_total Bytes written to the output file in the last run.",
+              "# TYPE mnc_written_bytes_total counter",
+              f"mnc_written_bytes_total {bytes_written}",
+              "# HELP mnc_input_bytes Total size of the merged text files in the last run.",
+              "# TYPE mnc_input_bytes gauge",
+              f"mnc_input_bytes {summary.input_bytes}",
+              "# HELP mnc_output_chars Characters in the merged output of the last run.",
+              "# TYPE mnc_output_chars gauge",
+              f"mnc_output_chars {summary.total_chars}",
+              "# HELP mnc_phase_duration_seconds Time spent in each phase of the last run.",
+              "# TYPE mnc_phase_duration_seconds gauge"]
+    for name, seconds in summary.phases.items():
+        lines.append(f'mnc_phase_duration_seconds{{phase="{_metric_label(name)}"}} {_metric_number(seconds)}')
+    lines += ["# HELP mnc_run_duration_seconds Wall time of the last run.",
+              "# TYPE mnc_run_duration_seconds gauge",
+              f"mnc_run_duration_seconds {_metric_number(summary.duration_seconds)}",
+              "# HELP mnc_exit_code Exit code of the last run.",
+              "# TYPE mnc_exit_code gauge",
+              f"mnc_exit_code {exit_code}",
+              "# HELP mnc_last_run_timestamp_seconds Unix time the last run finished.",
+              "# TYPE mnc_last_run_timestamp_seconds gauge",
+              f"mnc_last_run_timestamp_seconds {_metric_number(round(time.time(), 3))}"]
+    lines += _histogram_lines('mnc_file_size_bytes', 'Size of the files examined in the last run.',
+                              summary.size_histogram)
+    lines += _histogram_lines('mnc_file_read_seconds', 'Per-file read (or cache lookup) latency in the last run.',
+                              summary.read_seconds_histogram)
+    return '\n'.join(lines) + '\n'
+
+def write_metrics_file(path: str, content: str) -> None:
+    """原子写出指标文件:先写同目录下的临时文件再替换,采集端不会读到写了一半的内容。
+    临时文件不以 .prom 结尾,textfile collector 会忽略它。"""
+    import tempfile
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as f:
+            f.write(content)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+def write_run_metrics(args: Optional[argparse.Namespace], summary: MergeSummary,
+                      exit_code: int, bytes_written: int) -> None:
+    """指定了 --metrics-file 时写出本次运行的指标;失败只提示,不影响退出码"""
+    if args is None or not args.metrics_file:
+        return
+    try:
+        write_metrics_file(args.metrics_file, format_metrics(summary, exit_code, bytes_written))
+    except OSError as e:
+        print(f"⚠️  指标文件写出失败: {e}")
+
+def write_run_trace(args: Optional[argparse.Namespace], tracer: Optional[TraceRecorder]) -> None:
+    """指定了 --trace 时写出追踪文件;失败只提示,不影响退出码"""
+    if tracer is None:
+        return
+    try:
+        tracer.write(args.trace)
+        print(f"✅ 已写出追踪文件: {args.trace}")
+    except OSError as e:
+        print(f"⚠️  追踪文件写出失败: {e}")
+
+def build_run_report(summary: MergeSummary, exit_code: int, output_file: Optional[str],
+                     bytes_written: int) -> dict:
+    """机器可读的运行报告"""
+    return {
+        'exit_code': exit_code,
+        'output_file': output_file,
+        'base_path': summary.base_path,
+        'total_files': summary.total_files,
+        'text_files': summary.text_files,
+        'status_counts': {status.name: summary.count(status) for status in Status},
+        'total_chars': summary.total_chars,
+        'bytes_read': summary.bytes_read,
+        'input_bytes': summary.input_bytes,
+        'bytes_written': bytes_written,
+        'phases': {name: round(seconds, 6) for name, seconds in summary.phases.items()},
+        'duration_seconds': round(summary.duration_seconds, 6),
+        'slowest_files': [_file_timing_record(res) for res in summary.slowest_files],
+        'largest_files': [_file_timing_record(res) for res in summary.largest_files],
+        'extensions': {ext: {'files': totals.files, 'bytes_read': totals.bytes_read,
+                             'decoded_chars': totals.decoded_chars, 'seconds': round(totals.seconds, 6)}
+                       for ext, totals in summary.extension_totals.items()},
+        'skipped_large': summary.skipped_large,
+        'skipped_excluded_pattern': summary.skipped_excluded_pattern,
+        'failed': [{'path': path, 'error': reason} for path, reason in summary.failed],
+    }
+
+# 逐文件输出时各状态的显示文本(失败时附带原因)
+_STATUS_LINE_LABELS = {
+    Status.TEXT_SUCCESS: "✔  成功 (文本)",
+    Status.NON_TEXT: "🖼  跳过 (非文本)",
+    Status.SKIPPED_LARGE: "🟡 跳过 (文件过大)",
+    Status.SKIPPED_NOT_WHITELISTED: "⚪ 跳过 (未在白名单)",
+    Status.SKIPPED_EXCLUDED_PATTERN: "🔸 跳过 (排除模式)",
+    Status.FAILED: "❌ 失败",
+}
+
+# 进度行中各状态计数的简短标签
+_STATUS_PROGRESS_LABELS = [
+    (Status.TEXT_SUCCESS, "文本"),
+    (Status.NON_TEXT, "非文本"),
+    (Status.SKIPPED_LARGE, "过大"),
+    (Status.SKIPPED_NOT_WHITELISTED, "非白名单"),
+    (Status.SKIPPED_EXCLUDED_PATTERN, "排除模式"),
+    (Status.SKIPPED_EXCLUDED_PATH, "排除路径"),
+    (Status.FAILED, "失败"),
+]
+
+def print_result_status(res: ProcessResult, file=None) -> None:
+    """打印单个文件的处理结果;排除路径中的文件不输出到控制台"""
+    if res.status == Status.SKIPPED_EXCLUDED_PATH:
+        return
+    status_str = _STATUS_LINE_LABELS.get(res.status, "未知状态")
+    if res.status == Status.FAILED:
+        status_str = f"{status_str} ({res.error_message})"
+    display_path = truncate_path(res.path, MAX_PATH_DISPLAY_LEN)
+    print(f"{display_path} ===> {status_str}", file=file)
+
+def _display_width(text: str) -> int:
+    """终端中的显示宽度:中文等全角字符占两列"""
+    return sum(2 if unicodedata.east_asian_width(c) in ('W', 'F') else 1 for c in text)
+
+class ProgressRenderer:
+    """节流的进度显示:按固定频率刷新一行吞吐量与各状态计数,避免大量文件时控制台输出成为瓶颈。
+    逐文件的行只在详细模式或文件失败时输出。实例本身可作为 merge() 的 on_result 回调;
+    调用 start() 后由后台线程按间隔刷新,长时间没有文件完成(如读取大文件或慢速磁盘)时进度行也会更新。"""
+
+    def __init__(self, verbose: bool = False, stream=None):
+        self.stream = stream if stream is not None else sys.stdout
+        self.verbose = verbose
+        try:
+            self.is_tty = self.stream.isatty()
+        except (AttributeError, ValueError):
+            self.is_tty = False
+        self.interval = PROGRESS_REFRESH_SECONDS if self.is_tty else PROGRESS_LOG_SECONDS
+        self.counts: Dict[Status, int] = defaultdict(int)
+        self.files = 0
+        self.bytes = 0
+        self.start_time = time.monotonic()
+        self._last_render = self.start_time
+        self._line_width = 0  # 终端中当前进度行的显示宽度
+        # 回调与刷新线程都会写出,计数与输出流由同一把锁保护
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """启动后台刷新线程"""
+        self._thread = threading.Thread(target=self._refresh_loop, name="mNc-progress", daemon=True)
+        self._thread.start()
+
+    def _refresh_loop(self) -> None:
+        timeout = self.interval
+        while not self._stopped.wait(timeout):
+            with self._lock:
+                now = time.monotonic()
+                if now - self._last_render >= self.interval:
+                    self._render(now)
+                timeout = max(self.interval - (now - self._last_render), 0.01)
+
+    def __call__(self, res: ProcessResult) -> None:
+        with self._lock:
+            self.files += 1
+            self.counts[res.status] += 1
+            if res.status in (Status.TEXT_SUCCESS, Status.NON_TEXT):
+                self.bytes += res.size or 0
+            if self.verbose or res.status == Status.FAILED:
+                self._clear_line()
+                print_result_status(res, file=self.stream)
+            now = time.monotonic()
+            if now - self._last_render >= self.interval:
+                self._render(now)
+
+    def format_line(self, now: float) -> str:
+        elapsed = max(now - self.start_time, 1e-6)
+        parts = [f"已处理 {self.files:,} 个文件",
+                 f"{self.files / elapsed:,.0f} 个/秒",
+                 f"{self.bytes / elapsed / (1024 * 1024):,.1f} MB/秒"]
+        parts += [f"{label} {self.counts[status]:,}" for status, label in _STATUS_PROGRESS_LABELS
+                  if self.counts.get(status)]
+        return " | ".join(parts)
+
+    def _render(self, now: float) -> None:
+        line = self.format_line(now)
+        if self.is_tty:
+            # 截断到终端宽度,避免换行后无法用 \r 覆盖
+            import shutil
+            max_width = shutil.get_terminal_size().columns - 1
+            while _display_width(line) > max_width:
+                line = line[:-1]
+            width = _display_width(line)
+            self.stream.write('\r' + line + ' ' * max(0, self._line_width - width))
+            self._line_width = width
+        else:
+            self.stream.write(line + '\n')
+        self.stream.flush()
+        self._last_render = now
+
+    def _clear_line(self) -> None:
+        if self.is_tty and self._line_width:
+            self.stream.write('\r' + ' ' * self._line_width + '\r')
+            self._line_width = 0
+
+    def close(self) -> None:
+        """停止后台刷新并输出最终的进度行"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            if self.files:
+                self._render(time.monotonic())
+            if self.is_tty and self._line_width:
+                self.stream.write('\n')
+                self._line_width = 0
+
+def merge_and_report(path_args: List[str], options: MergeOptions,
+                     args: Optional[argparse.Namespace] = None) -> dict:
+    """执行合并,写出输出文件并复制到剪贴板,打印报告;返回 JSON 运行报告(含退出码)"""
+    batch = args is not None and args.batch
+    use_clipboard = not (args is not None and args.no_clipboard)
+    progress = ProgressRenderer(verbose=args is not None and args.verbose)
+    profiler = ThreadProfiler() if args is not None and (args.profile or args.profile_out) else None
+    tracer = TraceRecorder() if args is not None and args.trace else None
+    memprofiler = MemoryProfiler() if args is not None and args.memprofile else None
+    diagnostics = [tool for tool in (memprofiler, tracer, profiler) if tool is not None]
+    output_file = None
+    output_written = False
+    bytes_written = 0
+    total_chars = 0
+    # 合并或写出中途出错时也要停止诊断工具,否则它们会一直挂在全局钩子上
+    for tool in diagnostics:
+        tool.start()
+    try:
+        print("--- 正在发现并处理文件... ---\n")
+        progress.start()
+        with merge(path_args, options, on_result=progress) as merged:
+            try:
+                # 第一段(统计头)产出时分析阶段已经完成
+                first_chunk = next(merged, None)
+            finally:
+                progress.close()
+            summary = merged.summary
+            if first_chunk is not None:
+                # 按最终顺序流式写出,内存中只保留预取窗口内的文件内容
+                output_file = resolve_output_file(args)
+                try:
+                    with open(output_file, 'w', encoding='utf-8') as f:
+                        f.write(first_chunk)
+                        for chunk in merged:
+                            f.write(chunk)
+                    output_written = True
+                    bytes_written = os.path.getsize(output_file)
+                    print(f"\n✅ 已生成文件: {output_file}")
+                except Exception as e:
+                    print(f"\n❌ 文件生成失败: {e}")
+                total_chars = summary.total_chars
+                
+                # 复制到剪贴板(如果可用)
+                if use_clipboard and PYPERCLIP_AVAILABLE:
+                    try:
+                        with PhaseTimer(summary.phases).phase('clipboard'):
+                            # 剪贴板需要完整文本:优先从刚写出的文件读回,避免保留多份副本;
+                            # 写出失败时重新合并一次(缓存命中时很快)
+                            if output_written:
+                                with open(output_file, 'r', encoding='utf-8') as f:
+                                    clean_text = f.read()
+                            else:
+                                clean_text = "".join(merge(path_args, options))
+                                total_chars = len(clean_text)
+                            pyperclip.copy(clean_text)
+                        print("✅ 已复制到剪贴板")
+                    except Exception as e:
+                        print(f"⚠️  剪贴板复制失败: {e}")
+                elif use_clipboard:
+                    print("ℹ️  未安装 pyperclip 模块,跳过剪贴板复制")
+            elif summary.total_files:
+                print("\nℹ️ 未处理任何有效文本内容。")
+    finally:
+        for tool in diagnostics:
+            tool.stop()
+    
+    if summary.total_files == 0:
+        print("未找到任何文件进行处理。")
+        write_run_trace(args, tracer)
+        write_run_metrics(args, summary, EXIT_NOTHING_MERGED, 0)
+        return build_run_report(summary, EXIT_NOTHING_MERGED, None, 0)
+
+    print("\n----- 处理报告 -----")
+    print(f"✔️  成功处理文本文件: {summary.text_files} 个")
+    print(f"📝 总字符数: {total_chars:,} 字符" if summary.text_files else "")
+    print(f"🔩 跳过的非文本文件: {summary.count(Status.NON_TEXT)} 个")
+    print(f"⏭️  因过大而跳过的文件: {len(summary.skipped_large)} 个")
+    print(f"⚪  未在白名单的文件: {summary.count(Status.SKIPPED_NOT_WHITELISTED)} 个")
+    print(f"🔸 匹配排除模式的文件: {len(summary.skipped_excluded_pattern)} 个")
+    print(f"⏭️  排除路径中的文件: {summary.count(Status.SKIPPED_EXCLUDED_PATH)} 个")
+    print(f"❌ 失败的文件或路径: {len(summary.failed)} 个")
+    print(f"⏱️  总耗时: {summary.analysis_seconds:.2f} 秒")
+
+    if summary.skipped_large:
+        print("\n跳过的大文件列表:")
+        for path in summary.skipped_large:
+            print(f"  - {path}")
+
+    if summary.skipped_excluded_pattern:
+        print("\n匹配排除模式的文件列表:")
+        for path in summary.skipped_excluded_pattern:
+            print(f"  - {path}")
+
+    if summary.failed:
+        print("\n失败的路径列表:")
+        for path, reason in summary.failed:
+            print(f"  - {path}\n    原因: {reason}")
+    
+    print("--------------------")
+    
+    if args is not None and (args.verbose or args.profile or args.profile_out):
+        print_file_timing_report(summary)
+    if profiler is not None:
+        print_profile_report(summary, profiler, profile_out=args.profile_out)
+    if memprofiler is not None:
+        print_memory_report(summary, memprofiler)
+    write_run_trace(args, tracer)
+
+    if first_chunk is None:
+        exit_code = EXIT_NOTHING_MERGED
+    elif not output_written:
+        exit_code = EXIT_OUTPUT_ERROR
+    elif summary.failed:
+        exit_code = EXIT_FILES_FAILED
+    else:
+        exit_code = EXIT_OK
+    
+    write_run_metrics(args, summary, exit_code, bytes_written)
+    
+    if not batch:
+        pause_before_exit(bool(summary.failed))
+    return build_run_report(summary, exit_code, output_file if output_written else None, bytes_written)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())